@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+# @file build-line-index.py
+# @brief Build the sidecar line index used by select-lines.py and lines.py.
+#
+# @author Darlene Stewart
+#
+# Traitement multilingue de textes / Multilingual Text Processing
+# Centre de recherche en technologies numériques / Digital Technologies Research Centre
+# Conseil national de recherches Canada / National Research Council Canada
+# Copyright 2026, Sa Majeste le Roi du Chef du Canada /
+# Copyright 2026, His Majesty the King in Right of Canada
+
+import os
+import zlib
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+from portage_utils import (
+    fatal_error,
+    printCopyright,
+    verbose,
+    warn,
+    DebugAction,
+    get_codec,
+    GzipLineIndex,
+    HelpAction,
+    Progress,
+    TextLineIndex,
+    VerboseAction,
+)
+
+
+def get_args():
+   """Command line argument processing."""
+
+   usage = "build-line-index.py [options] file [file2 ...]"
+   help = """
+   Build the line index of each file, saved as <file>.lineidx, so that
+   select-lines.py and lines.py can jump directly to the lines they select.
+
+   Files must be plain text or gzip compressed (.gz).
+
+   For plain text, the index holds the byte offset of every k-th line, using
+   8 bytes per entry, and lines are looked up through mmap.
+
+   For .gz files, checkpoints can only be placed at gzip member boundaries,
+   so the index is only useful for files with many members, such as those
+   written with PORTAGE_GZIP_THREADS set or by bgzip.
+
+   An index is ignored once its file is modified: rebuild it then.
+   """
+
+   parser = ArgumentParser(usage=usage, description=help,
+                           formatter_class=RawDescriptionHelpFormatter, add_help=False)
+   parser.add_argument("-h", "-help", "--help", action=HelpAction)
+   parser.add_argument("-v", "--verbose", action=VerboseAction)
+   parser.add_argument("-d", "--debug", action=DebugAction)
+   parser.add_argument("-k", dest="k", default=1, type=int,
+                       help="for plain text, index the offset of every k-th line [%(default)s]")
+   parser.add_argument("-span", "--span", dest="span", default=1 << 20, type=int,
+                       help="min uncompressed bytes between gzip checkpoints [%(default)s]")
+
+   parser.add_argument("files", nargs="+", type=str, help="files to index")
+
+   cmd_args = parser.parse_args()
+   if cmd_args.k < 1:
+      fatal_error("-k must be >= 1:", cmd_args.k)
+
+   return cmd_args
+
+
+def main():
+   printCopyright("build-line-index.py", 2026)
+   os.environ['PORTAGE_INTERNAL_CALL'] = '1'
+
+   cmd_args = get_args()
+
+   for filename in cmd_args.files:
+      if filename.endswith(".gz"):
+         try:
+            progress = Progress("build-line-index.py: " + filename)
+            index = GzipLineIndex.build(filename, span=cmd_args.span, progress=progress)
+            progress.done()
+         except (IOError, EOFError, zlib.error) as e:
+            fatal_error("Cannot index", filename + ":", e)
+         index.save()
+         verbose(filename + ":", index.num_lines, "lines,", len(index.coffsets), "checkpoints")
+         if len(index.coffsets) == 1 and os.path.getsize(filename) > cmd_args.span:
+            warn(filename, "is a single gzip member, so its index cannot speed up access.")
+      elif get_codec(filename) is not None:
+         fatal_error("Don't know how to index compressed file", filename, "(only .gz is supported)")
+      else:
+         try:
+            progress = Progress("build-line-index.py: " + filename,
+                                total_bytes=Progress.input_size(filename))
+            index = TextLineIndex.build(filename, k=cmd_args.k, progress=progress)
+            progress.done()
+         except IOError as e:
+            fatal_error("Cannot index", filename + ":", e)
+         index.save()
+         verbose(filename + ":", index.num_lines, "lines,", len(index.offsets), "offsets")
+
+if __name__ == '__main__':
+    main()
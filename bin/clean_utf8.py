@@ -15,29 +15,90 @@
 import click
 import re
 import sys
+import time
 
+from collections import OrderedDict, deque
+from itertools import islice
+from time import perf_counter
 from typing import (
+    AnyStr,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
     List,
+    Optional,
+    Tuple,
     Union,
 )
 from unicodedata import normalize
 
 try:
-    import regex
+    from unicodedata import is_normalized
+except ImportError:
+    # Python < 3.8
+    def is_normalized(form: str, text: str) -> bool:
+        return normalize(form, text) == text
 
-    regex_available = True
-except ModuleNotFoundError:
-    # print("Failed to import regex to filter out Extended Control characters.", file=sys.stderr)
-    # print("Consider `pip install --user regex`", file=sys.stderr)
-    regex_available = False
 
-
-from portage_utils import open
+from portage_utils import open, Progress
 
 
 __version__ = "1.1"
 
 
+re_bytes_non_ascii = re.compile(rb"[\x80-\xff]")
+
+# When instrumenting, one line in TIMING_SAMPLE is timed, see CleanUTF8.stats()
+TIMING_SAMPLE = 64
+
+
+def strip_lines(text: bytes) -> bytes:
+    """
+    str.strip() each line of pure ASCII text.
+    """
+    # Much faster than a MULTILINE regex, which tries to match at every space.
+    return b"\n".join([line.strip(b"\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f ") for line in text.split(b"\n")])
+
+
+# A chunk of text for clean_file() and clean_in_parallel()
+Chunk = Union[List[str], bytes]
+
+# A step of CleanUTF8.clean_line() or clean_bytes(): (name, step, count), see
+# CleanUTF8._apply_steps()
+Step = Tuple[str, Callable, Optional[Callable]]
+
+
+def count_removed(rule: str) -> Callable:
+    """
+    Return a step count function adding the number of characters the step
+    removed to the counts of rule.
+    """
+
+    def count(counts: Dict[str, int], text, cleaned):
+        counts[rule] += len(text) - len(cleaned)
+
+    return count
+
+
+def count_escaped_separators(counts: Dict[str, int], text, cleaned):
+    """
+    Step count function for the phrase_table rule, which escapes ||| as ___|||___.
+    """
+    if isinstance(text, bytes):
+        counts["phrase_table"] += cleaned.count(b"___|||___") - text.count(b"___|||___")
+    else:
+        counts["phrase_table"] += cleaned.count("___|||___") - text.count("___|||___")
+
+# Estimated memory used by a CleanUTF8 cache entry, besides its two strings
+CACHE_ENTRY_OVERHEAD = 100
+
+# The characters str.split() and \s split on, besides " ".
+WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004"
+    "\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+)
+
 
 class CleanUTF8:
     """
@@ -50,66 +111,49 @@ class CleanUTF8:
         phrase_table: bool = False,
         extended_crtl_character_filtering: bool = False,
         normalization_type: str = None,
+        cache_memory: int = 0,
+        instrument: bool = False,
     ):
         """
         wide_punct: Substitute fullwidth punctuation for their equivalent in ascii.
         phrase_table: Escapes phrase table entry separator " ||| " for " ___|||___ "
         extended_crtl_character_filtering: filter out all unicode characters and not just the ascii control characters.
         normalization_type: perform unicode normalization ( None, "NFD", "NFC", "NFKD", "NFKC" )
+        cache_memory: keep the cleaned lines in an LRU cache of at most this many bytes ( 0: no cache )
+        instrument: count the changes made by each rule and time them, see stats()
         """
         self.wide_punct = wide_punct
         self.phrase_table = phrase_table
         self.normalization_type = normalization_type
 
-        self.re_hyphens = re.compile(r"[\u001E\u00AD\u2011]")
-        self.re_dhyphens = re.compile(r"\x1F")
-        self.re_space = re.compile(r"[\u2060\uFEFF\u00A0\u2007\u202F\u2028\u2029]")
-        self.re_ctrl = re.compile(r"[\x01-\x09\x0B\x0C\x0E-\x1D\x7F]")
+        # equivalent to crlf2lf.sh: convert DOS newlines to Linux ones
         self.re_crlf = re.compile(r"\x0D$")
+        # If ||| appears stand-alone in text, that causes problems with Portage
         self.re_phrase_table = re.compile(r"(^| )\|\|\|(?= |$)")
-        self.re_wide = re.compile(r"([，。：）（；？﹗．﹪﹡﹟])")
-        self.re_mspace = re.compile(r"\s+")  # \s => [ \t\n\r\f\v]
 
         self.re_ctrl_extended = None
         if extended_crtl_character_filtering:
-            if not regex_available:
-                assert "Can't perform unicode extended control character filtering since regex is not installed."
+            # regex is only needed here, and takes longer to import than the rest of clean_utf8.py
+            try:
+                import regex
+            except ModuleNotFoundError:
+                raise ModuleNotFoundError(
+                    "Can't perform unicode extended control character filtering since regex "
+                    "is not installed; consider `pip install --user regex`."
+                )
             self.re_ctrl_extended = regex.compile(r"\p{C}")
 
-    def __call__(self, text: Union[str, List[str]]) -> Union[str, List[str]]:
-        """
-        Apply filters to either a string or a list of string.
-        """
-        if isinstance(text, list):
-            return self.clean_list(text)
-        else:
-            return self.clean_line(text)
-
-    def clean_list(self, list_of_lines: List[str]) -> List[str]:
-        """
-        Apply filters to either a list of string.
-        """
-        assert isinstance(list_of_lines, list)
-        return [self.clean_line(line) for line in list_of_lines]
-
-    def clean_line(self, line: str) -> str:
-        """
-        Apply filters to either a string.
-        """
-        assert isinstance(line, str)
-        line = line.rstrip()
-
-        if self.normalization_type is not None:
-            line = normalize(self.normalization_type, line)
-
+        # The single-character substitutions are compiled into str.translate
+        # tables, so that clean_line() makes one pass over the line for all of
+        # them.  They map disjoint sets of characters to characters outside those
+        # sets, so applying them together gives the same result as one at a time.
+        table = {}
         # Convert various non-breaking hyphen encodings to -: \xAD and \x1E for MS
         # Word, \x2011 for Unicode.  Warning: for html documents, \xAD should be
         # stripped, rather than converted to -.
-        line = self.re_hyphens.sub("-", line)
-
+        table.update(dict.fromkeys(map(ord, "\u001E\u00AD\u2011"), "-"))
         # Strip out the MS Word discretional hyphen, \x1F
-        line = self.re_dhyphens.sub("", line)
-
+        table[0x1F] = None
         # Replace various special purpose spaces by regular spaces:
         # U+2060: Word joiner / WJ, "a zero width non-breaking space (only) intended
         #         for disambiguation of functions for byte order mark" (Unicode standard);
@@ -127,38 +171,625 @@ class CleanUTF8:
         #         \n as the newline, sometimes with user-defined semantics, and this
         #         script gets applied to line-aligned text, so the only legal thing we can
         #         do here is map them to spaces.
-        line = self.re_space.sub(" ", line)
-
+        table.update(dict.fromkeys(map(ord, "\u2060\uFEFF\u00A0\u2007\u202F\u2028\u2029"), " "))
         # replace remaining control characters by spaces.
-        line = self.re_ctrl.sub(" ", line)
+        table.update(dict.fromkeys(
+            [*range(0x01, 0x0A), 0x0B, 0x0C, *range(0x0E, 0x1E), 0x7F], " "))
+        # Basic wide punctuation mapping
+        wide_table = {
+            ord(wide): f" {narrow} "
+            for wide, narrow in zip("，。：）（；？﹗．﹪﹡﹟", ",.:)(;?!.%*#")
+        }
+        # Wide punctuation is mapped after ||| is escaped, since the spaces it
+        # inserts could otherwise create new stand-alone |||.
+        if wide_punct and not phrase_table:
+            table.update(wide_table)
+        self.translate_table = table
+        self.wide_translate_table = wide_table if wide_punct and phrase_table else None
+
+        # Fast path: a line none of the rules can change is returned as is.
+        # re_unclean matches anything a rule could apply to: the characters in
+        # the translate tables, whitespace other than single spaces between
+        # words, ASCII control characters (all of \p{C} in ASCII) and |||.
+        # Normalization and \p{C} only need checking on non-ASCII lines.
+        triggers = set(table) | set(map(ord, WHITESPACE))
+        triggers.update(range(0x00, 0x20), [0x7F])
+        if wide_punct:
+            triggers.update(wide_table)
+        unclean = [
+            "[" + "".join(re.escape(chr(c)) for c in sorted(triggers)) + "]",
+            "  ",
+            "^ ",
+            " $",
+        ]
+        if phrase_table:
+            unclean.append(r"\|\|\|")
+        self.re_unclean = re.compile("|".join(unclean))
+        # Byte-level rules for pure ASCII text, see clean_bytes().
+        ctrl = bytes([*range(0x01, 0x0A), 0x0B, 0x0C, *range(0x0E, 0x1E), 0x7F])
+        self.bytes_table = bytes.maketrans(ctrl + b"\x1e", b" " * len(ctrl) + b"-")
+        self.re_bytes_phrase_table = re.compile(rb"(^| )\|\|\|(?= |$)", re.MULTILINE)
+        self.re_bytes_mspace = re.compile(rb"  +")
+
+        # The steps of clean_line() and clean_bytes(), see _apply_steps()
+        self.line_steps = self._line_steps()
+        self.ascii_bytes_steps = self._ascii_bytes_steps(ctrl)
+
+        # Instrumentation: the rules that are on, in the order they apply, and
+        # the steps timed.  The single-character rules share one step.
+        self.instrument = instrument
+        self.rules = [
+            "normalization",
+            "hyphens",
+            "discretionary_hyphens",
+            "special_spaces",
+            "control_chars",
+            "crlf",
+            "phrase_table",
+            "wide_punct",
+            "whitespace",
+            "extended_control_chars",
+        ]
+        off = set()
+        if normalization_type is None:
+            off.add("normalization")
+        if not phrase_table:
+            off.add("phrase_table")
+        if not wide_punct:
+            off.add("wide_punct")
+        if self.re_ctrl_extended is None:
+            off.add("extended_control_chars")
+        self.rules = [rule for rule in self.rules if rule not in off]
+        self.steps = [name for name, _, _ in self.line_steps]
+        self.rule_of_char = {}
+        for rule, chars in (
+            ("hyphens", "\u001E\u00AD\u2011"),
+            ("discretionary_hyphens", "\x1F"),
+            ("special_spaces", "\u2060\uFEFF\u00A0\u2007\u202F\u2028\u2029"),
+            ("control_chars", "".join(map(chr, ctrl))),
+            ("wide_punct", "，。：）（；？﹗．﹪﹡﹟"),
+        ):
+            self.rule_of_char.update(dict.fromkeys(chars, rule))
+        self.re_rule_chars = re.compile(
+            "[" + "".join(re.escape(chr(c)) for c in sorted(table)) + "]"
+        )
+        self.re_wide_chars = re.compile(r"[，。：）（；？﹗．﹪﹡﹟]")
+        self.instrumented_lines = 0
+
+        # LRU cache of cleaned lines, for corpora that repeat lines a lot.
+        # cache_used is an estimate of the memory used by its entries.
+        self.cache_memory = cache_memory
+        self.cache = OrderedDict()
+        self.cache_used = 0
+
+        self.reset_counts()
+        self.options = dict(
+            wide_punct=wide_punct,
+            phrase_table=phrase_table,
+            extended_crtl_character_filtering=extended_crtl_character_filtering,
+            normalization_type=normalization_type,
+            cache_memory=cache_memory,
+            instrument=instrument,
+        )
+
+    # Statistics on the lines cleaned, see clean_line(), clean_bytes() and
+    # clean_file(); rule_counts and rule_seconds are only kept when
+    # instrumenting.
+    COUNTS = (
+        "line_count",
+        "byte_count",
+        "fast_path_count",
+        "bytes_path_count",
+        "cache_hits",
+        "cache_misses",
+    )
 
-        # equivalent to crlf2lf.sh: convert DOS newlines to Linux ones
-        line = self.re_crlf.sub("", line)
+    def reset_counts(self):
+        for name in self.COUNTS:
+            setattr(self, name, 0)
+        self.rule_counts = dict.fromkeys(self.rules, 0)
+        self.rule_seconds = dict.fromkeys(self.steps, 0.0)
+
+    def get_counts(self) -> Dict[str, Union[int, dict]]:
+        counts = {name: getattr(self, name) for name in self.COUNTS}
+        counts["rule_counts"] = dict(self.rule_counts)
+        counts["rule_seconds"] = dict(self.rule_seconds)
+        return counts
+
+    def add_counts(self, counts: Dict[str, Union[int, dict]]):
+        for name, count in counts.items():
+            if isinstance(count, dict):
+                total = getattr(self, name)
+                for key, value in count.items():
+                    total[key] += value
+            else:
+                setattr(self, name, getattr(self, name) + count)
+
+    def stats(self) -> dict:
+        """
+        Statistics on the lines cleaned, for a JSON summary.
 
-        # If ||| appears stand-alone in text, that causes problems with Portage
-        if self.phrase_table:
-            line = self.re_phrase_table.sub(" ___|||___", line)
+        rule_counts is the number of changes each rule made: characters
+        replaced, ||| escaped, whitespace characters removed, and lines
+        changed by normalization.  Lines found in the cache are not counted
+        again.  rule_seconds is the time spent in each step of clean_line(),
+        estimated from one line in TIMING_SAMPLE, and clean_bytes() steps.
+        """
+        stats = dict(
+            lines=self.line_count,
+            bytes=self.byte_count,
+            already_clean=self.fast_path_count,
+            pure_ascii=self.bytes_path_count,
+        )
+        if self.cache_memory:
+            lookups = self.cache_hits + self.cache_misses
+            stats["cache"] = dict(
+                hits=self.cache_hits,
+                lookups=lookups,
+                hit_rate=round(self.cache_hits / max(lookups, 1), 4),
+                lines=len(self.cache),
+                megabytes=round(self.cache_used / 1e6, 1),
+            )
+        if self.instrument:
+            stats["rule_counts"] = dict(self.rule_counts)
+            stats["rule_seconds"] = {
+                step: round(seconds, 3) for step, seconds in self.rule_seconds.items()
+            }
+        return stats
+
+    def __call__(
+        self, text: Union[str, List[str], Iterable[str]]
+    ) -> Union[str, List[str], Iterator[str]]:
+        """
+        Apply filters to either a string, a list of string or, lazily, any other
+        iterable of strings (see clean_iter()).
+        """
+        if isinstance(text, list):
+            return self.clean_list(text)
+        elif isinstance(text, str):
+            return self.clean_line(text)
+        else:
+            return self.clean_iter(text)
 
-        # Basic wide punctuation mapping
-        if self.wide_punct:
-            line = self.re_wide.sub(r" \g<1> ", line)
-            line = line.translate(str.maketrans("，。：）（；？﹗．﹪﹡﹟", ",.:)(;?!.%*#"))
+    def clean_list(self, list_of_lines: List[str]) -> List[str]:
+        """
+        Apply filters to either a list of string.
+        """
+        assert isinstance(list_of_lines, list)
+        return [self.clean_line(line) for line in list_of_lines]
+
+    def clean_iter(self, lines: Iterable[str]) -> Iterator[str]:
+        """
+        Lazily apply filters to an iterable of strings, e.g., an open file.
 
-        # Collapse multiple spaces to a single space
-        line = self.re_mspace.sub(" ", line)
-        line = line.strip()
+        Each line is stripped first, as clean_utf8.py does, so lines read
+        from a file can be passed as is.
+        """
+        return (self.clean_line(line.strip()) for line in lines)
 
+    def clean_file(
+        self,
+        infile: str,
+        outfile: str,
+        batch_size: int = 10000,
+        jobs: int = 1,
+        binary: bool = False,
+        progress: Progress = None,
+    ):
+        """
+        Clean infile into outfile, as clean_utf8.py does.
+
+        Both are opened with portage_utils.open(), so they can be "-",
+        compressed files or pipes.
+
+        batch_size: number of lines read, cleaned and written at a time
+        jobs: clean the batches in this many processes, see clean_in_parallel()
+        binary: clean pure ASCII lines without decoding them, see clean_bytes();
+            the batches are then buffers of about 1 MB
+        progress: a portage_utils.Progress updated as batches are read
+        """
+        if binary:
+            with open(infile, mode="rb") as cin, open(outfile, mode="wb") as cout:
+                buffers = self._watch_input(read_buffers(cin), progress)
+                if jobs > 1:
+                    buffers = clean_in_parallel(self, buffers, jobs)
+                else:
+                    buffers = map(self.clean_bytes, buffers)
+                for buffer in buffers:
+                    cout.write(buffer)
+            return
+
+        with open(infile, mode="r", encoding="UTF-8", newline="\n") as cin, open(
+            outfile, mode="w", encoding="UTF-8"
+        ) as cout:
+            batches = iter(lambda: list(islice(cin, batch_size)), [])
+            if self.instrument or progress is not None:
+                batches = self._watch_input(batches, progress)
+            if jobs > 1:
+                batches = clean_in_parallel(self, batches, jobs)
+            else:
+                batches = (self.clean_list([line.strip() for line in batch]) for batch in batches)
+            for batch in batches:
+                cout.writelines(line + "\n" for line in batch)
+
+    def _watch_input(self, chunks: Iterable[Chunk], progress: Progress) -> Iterator[Chunk]:
+        """
+        Add the size of the chunks read by clean_file() to self.byte_count,
+        and report their lines and size to progress, if not None.
+
+        Lists of lines are only encoded to count their bytes when
+        instrumenting; otherwise, progress gets their number of characters.
+        """
+        for chunk in chunks:
+            if isinstance(chunk, bytes):
+                lines, size = chunk.count(b"\n"), len(chunk)
+                self.byte_count += size
+            elif self.instrument:
+                lines, size = len(chunk), len("".join(chunk).encode("UTF-8"))
+                self.byte_count += size
+            else:
+                lines, size = len(chunk), sum(map(len, chunk))
+            if progress is not None:
+                progress.update(lines, size)
+            yield chunk
+
+    def is_clean(self, line: str) -> bool:
+        """
+        Return True if clean_line() would return line unchanged.
+        """
+        if self.re_unclean.search(line) is not None:
+            return False
+        if line.isascii():
+            return True
+        if self.re_ctrl_extended is not None and self.re_ctrl_extended.search(line):
+            return False
+        if self.normalization_type is not None:
+            return is_normalized(self.normalization_type, line)
+        return True
+
+    def clean_line(self, line: str) -> str:
+        """
+        Apply filters to either a string.
+
+        Lines that are already clean are returned as is, the
+        single-character rules are applied by one or two str.translate()
+        calls, and only the context-sensitive rules use regular expressions.
+
+        With a cache, the other lines are looked up in it first.
+
+        self.line_count and self.fast_path_count count the lines cleaned and
+        the lines returned as is; self.cache_hits and self.cache_misses count
+        the cache lookups.
+        """
+        assert isinstance(line, str)
+        self.line_count += 1
+        if self.is_clean(line):
+            self.fast_path_count += 1
+            return line
+
+        if not self.cache_memory:
+            return self._clean_line(line)
+
+        cleaned = self.cache.get(line)
+        if cleaned is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(line)
+            return cleaned
+        self.cache_misses += 1
+        cleaned = self._clean_line(line)
+        size = sys.getsizeof(line) + sys.getsizeof(cleaned) + CACHE_ENTRY_OVERHEAD
+        if size <= self.cache_memory:
+            self.cache[line] = cleaned
+            self.cache_used += size
+            while self.cache_used > self.cache_memory:
+                old_line, old_cleaned = self.cache.popitem(last=False)
+                self.cache_used -= (
+                    sys.getsizeof(old_line) + sys.getsizeof(old_cleaned) + CACHE_ENTRY_OVERHEAD
+                )
+        return cleaned
+
+    def _line_steps(self) -> List[Step]:
+        """
+        The steps of clean_line() that are on, in order, see _apply_steps().
+        """
+        steps = []
+        if self.normalization_type is not None:
+
+            def count_normalization(counts, line, cleaned):
+                counts["normalization"] += cleaned != line
+
+            steps.append(
+                (
+                    "normalization",
+                    lambda line: normalize(self.normalization_type, line),
+                    count_normalization,
+                )
+            )
+
+        # hyphens, discretionary hyphens, special spaces, control characters
+        # and, without phrase_table, wide punctuation.
+        def count_chars(counts, line, cleaned):
+            for char in self.re_rule_chars.findall(line):
+                counts[self.rule_of_char[char]] += 1
+
+        steps.append(
+            (
+                "single_character_rules",
+                lambda line: line.translate(self.translate_table),
+                count_chars,
+            )
+        )
+        steps.append(
+            (
+                "crlf",
+                lambda line: self.re_crlf.sub("", line) if "\r" in line else line,
+                count_removed("crlf"),
+            )
+        )
+        if self.phrase_table:
+            steps.append(
+                (
+                    "phrase_table",
+                    lambda line: (
+                        self.re_phrase_table.sub(" ___|||___", line) if "|||" in line else line
+                    ),
+                    count_escaped_separators,
+                )
+            )
+        if self.wide_translate_table is not None:
+
+            def count_wide_punct(counts, line, cleaned):
+                counts["wide_punct"] += len(self.re_wide_chars.findall(line))
+
+            steps.append(
+                (
+                    "wide_punct",
+                    lambda line: line.translate(self.wide_translate_table),
+                    count_wide_punct,
+                )
+            )
+        # Collapse multiple spaces to a single space and strip: str.split()
+        # splits on exactly the characters \s matches.
+        steps.append(
+            ("whitespace", lambda line: " ".join(line.split()), count_removed("whitespace"))
+        )
         if self.re_ctrl_extended is not None:
-            line = self.re_ctrl_extended.sub("", line)
+            steps.append(
+                (
+                    "extended_control_chars",
+                    lambda line: self.re_ctrl_extended.sub("", line),
+                    count_removed("extended_control_chars"),
+                )
+            )
+        return steps
+
+    def _ascii_bytes_steps(self, ctrl: bytes) -> List[Step]:
+        """
+        The steps of clean_bytes() for lines of pure ASCII text: the rules of
+        clean_line(), in the same order, restricted to the ASCII characters.
+        ctrl is the ASCII control characters replaced by spaces.
+        """
+        # Each step is skipped when a cheap test shows it has nothing to do:
+        # per-match work in re is what makes byte regexes slow on big buffers.
+
+        # str.strip() of each line, as done before clean_line().  Otherwise,
+        # leading and trailing whitespace is collapsed away below, except for
+        # \x1e, which would become -, and \r, which doesn't separate |||.
+        # When instrumenting, lines are always stripped first, so that the
+        # counts are those of the text mode.
+        def strip(text):
+            if self.instrument or b"\x1e" in text or (self.phrase_table and b"\r" in text):
+                return strip_lines(text)
+            return text
+
+        def count_chars(counts, text, cleaned):
+            counts["hyphens"] += text.count(b"\x1e")
+            counts["discretionary_hyphens"] += text.count(b"\x1f")
+            counts["control_chars"] += len(text) - len(text.translate(None, ctrl))
+
+        # " ".join(line.split()): the only whitespace left is " " and \r
+        def collapse_whitespace(text):
+            if b"\r" in text:
+                text = text.replace(b"\r", b" ")
+            if b"  " in text:
+                text = self.re_bytes_mspace.sub(b" ", text)
+            text = text.replace(b" \n", b"\n").replace(b"\n ", b"\n")
+            return text[1:] if text.startswith(b" ") else text
+
+        steps = [
+            ("whitespace", strip, None),
+            # hyphens, discretionary hyphens and control characters
+            (
+                "single_character_rules",
+                lambda text: text.translate(self.bytes_table, b"\x1f"),
+                count_chars,
+            ),
+        ]
+        if self.phrase_table:
+            steps.append(
+                (
+                    "phrase_table",
+                    lambda text: (
+                        self.re_bytes_phrase_table.sub(b" ___|||___", text)
+                        if b"|||" in text
+                        else text
+                    ),
+                    count_escaped_separators,
+                )
+            )
+        steps.append(("whitespace", collapse_whitespace, count_removed("whitespace")))
+        if self.re_ctrl_extended is not None:
+            # \x00 is the only character of \p{C} left
+            steps.append(
+                (
+                    "extended_control_chars",
+                    lambda text: text.replace(b"\x00", b""),
+                    count_removed("extended_control_chars"),
+                )
+            )
+        return steps
+
+    def _apply_steps(self, steps: List[Step], text: AnyStr, time_scale: float = 1.0) -> AnyStr:
+        """
+        Apply steps, a list of (name, step, count) triples, to text, in order.
+
+        step(text) returns text cleaned by the step.  When instrumenting,
+        count(self.rule_counts, text, cleaned), unless count is None, adds the
+        changes the step made to the rule counts, and the time each step
+        takes, times time_scale, is added to self.rule_seconds[name], unless
+        time_scale is 0.
+        """
+        if not self.instrument:
+            for _, step, _ in steps:
+                text = step(text)
+            return text
+
+        counts = self.rule_counts
+        seconds = self.rule_seconds
+        for name, step, count in steps:
+            if time_scale:
+                start = perf_counter()
+                cleaned = step(text)
+                seconds[name] += (perf_counter() - start) * time_scale
+            else:
+                cleaned = step(text)
+            if count is not None:
+                count(counts, text, cleaned)
+            text = cleaned
+        return text
+
+    def _clean_line(self, line: str) -> str:
+        """
+        The rules of clean_line(), without the fast path and the cache.
+
+        When instrumenting, one line in TIMING_SAMPLE is timed.
+        """
+        time_scale = 0
+        if self.instrument:
+            self.instrumented_lines += 1
+            if self.instrumented_lines % TIMING_SAMPLE == 0:
+                time_scale = TIMING_SAMPLE
+        return self._apply_steps(self.line_steps, line.rstrip(), time_scale)
+
+    def clean_bytes(self, text: bytes) -> bytes:
+        """
+        Strip and clean lines of UTF-8 encoded text, as clean_utf8.py does in
+        text mode.
+
+        text must consist of complete lines, each ending with \\n.  Runs of
+        pure ASCII lines are cleaned as a whole with bytes.translate() and
+        byte regular expressions, without being decoded.  Only the lines with
+        non-ASCII characters go through clean_line(), since the rules for
+        them (wide punctuation, Unicode spaces, normalization, \\p{C}) need
+        str.
+
+        self.bytes_path_count counts the lines cleaned without decoding.
+        """
+        assert isinstance(text, bytes) and text.endswith(b"\n")
+        out = []
+        pos = 0
+        while pos < len(text):
+            non_ascii = re_bytes_non_ascii.search(text, pos)
+            if non_ascii is None:
+                start = end = len(text)
+            else:
+                start = text.rfind(b"\n", pos, non_ascii.start()) + 1 or pos
+                end = text.index(b"\n", non_ascii.end()) + 1
+            if start > pos:
+                out.append(self._clean_ascii_bytes(text[pos:start]))
+            if end > start:
+                line = text[start : end - 1].decode("UTF-8").strip()
+                out.append(self.clean_line(line).encode("UTF-8") + b"\n")
+            pos = end
+        return b"".join(out)
+
+    def _clean_ascii_bytes(self, text: bytes) -> bytes:
+        """
+        clean_bytes() for lines of pure ASCII text.
+        """
+        count = text.count(b"\n")
+        self.line_count += count
+        self.bytes_path_count += count
+        return self._apply_steps(self.ascii_bytes_steps, text)
+
+
+_worker_clean = None
 
-        return line
+
+def _init_worker(options: dict):
+    """
+    Create the CleanUTF8 instance used by a worker process of clean_in_parallel().
+    """
+    global _worker_clean
+    _worker_clean = CleanUTF8(**options)
 
 
-def progress(*args):
+def _clean_chunk(chunk: Chunk) -> Tuple[Chunk, Dict[str, int]]:
     """
-    A simple progress report.
+    Clean a chunk of lines in a worker process of clean_in_parallel().
+    Returns the cleaned chunk and the worker's counts for it.
     """
-    print("\r", *args, sep="", end="", file=sys.stderr)
+    clean = _worker_clean
+    clean.reset_counts()
+    if isinstance(chunk, bytes):
+        cleaned = clean.clean_bytes(chunk)
+    else:
+        cleaned = clean.clean_list([line.strip() for line in chunk])
+    return cleaned, clean.get_counts()
+
+
+def clean_in_parallel(
+    clean: CleanUTF8, chunks: Iterable[Chunk], jobs: int
+) -> Iterator[Chunk]:
+    """
+    Clean chunks of text with a pool of jobs processes, yielding the cleaned
+    chunks in their original order.
+
+    A chunk is either a list of lines, cleaned as by clean_utf8.py in text
+    mode, or a buffer of complete lines, cleaned by clean_bytes().
+
+    At most 2 * jobs chunks are read ahead, so memory use does not depend on
+    the size of the input.
+
+    clean: each worker process uses a copy of clean, with the same options
+    and its own cache; the workers' counts are added to clean's.
+    """
+    import multiprocessing
+
+    options = clean.options
+    with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(options,)) as pool:
+        pending = deque()
+        chunks = iter(chunks)
+        while True:
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(pool.apply_async(_clean_chunk, (chunk,)))
+            if not pending:
+                break
+            if chunk is None or len(pending) >= 2 * jobs:
+                cleaned, counts = pending.popleft().get()
+                clean.add_counts(counts)
+                yield cleaned
+
+
+def read_buffers(f, buffer_size: int = 1 << 20) -> Iterator[bytes]:
+    """
+    Read binary file f in buffers of about buffer_size bytes made of complete
+    lines.  A last line missing its \\n is completed.
+    """
+    rest = b""
+    while True:
+        data = f.read(buffer_size)
+        if not data:
+            break
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            rest += data
+        else:
+            yield rest + data[:end]
+            rest = data[end:]
+    if rest:
+        yield rest + b"\n"
 
 
 
@@ -170,7 +801,7 @@ def progress(*args):
     is_flag=True,
     default=False,
     show_default=True,
-    help="Display progress",
+    help="Display progress, and statistics on the lines cleaned and the rules applied",
 )
 @click.option(
     "--phrase-table",
@@ -205,6 +836,42 @@ def progress(*args):
     default=None,
     help="Apply unicode normalization",
 )
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Clean chunks of lines in parallel in this many processes",
+)
+@click.option(
+    "--chunk-size",
+    "chunk_size",
+    type=click.IntRange(min=1),
+    default=10000,
+    show_default=True,
+    help="In text mode, number of lines cleaned at a time",
+)
+@click.option(
+    "-c",
+    "--cache",
+    "cache_mb",
+    type=click.FloatRange(min=0),
+    default=0,
+    metavar="MB",
+    help="Cache cleaned lines in at most MB megabytes per process, for repetitive corpora"
+    " [default: no cache]",
+)
+@click.option(
+    "-b",
+    "--binary",
+    "binary",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="Clean pure ASCII lines as bytes, without decoding them (same output)",
+)
 @click.argument("infile", default="-", type=str)
 @click.argument("outfile", default="-", type=str)
 @click.help_option("-h", "--help")
@@ -219,6 +886,10 @@ def main(
     extended_crtl_character_filtering: bool,
     normalization_type: str,
     verbose: bool,
+    jobs: int,
+    chunk_size: int,
+    binary: bool,
+    cache_mb: float,
 ):
     """
     Clean-up / normalize UTF8 text
@@ -230,16 +901,31 @@ def main(
         phrase_table=phrase_table,
         extended_crtl_character_filtering=extended_crtl_character_filtering,
         normalization_type=normalization_type,
+        cache_memory=int(cache_mb * 1e6),
+        instrument=verbose,
     )
 
-    with open(str(infile), mode="r", encoding="UTF-8", newline="\n") as cin, open(
-        str(outfile), mode="w", encoding="UTF-8"
-    ) as cout:
-        cin = map(str.strip, cin)
-        for count, line in enumerate(cin, 1):
-            if verbose and count % 1000 == 0:
-                progress(f"[{count} lines...]")
-            print(clean(line), file=cout)
+    progress = Progress(
+        "clean_utf8.py", total_bytes=Progress.input_size(str(infile)), enabled=verbose
+    )
+    clean.clean_file(
+        str(infile),
+        str(outfile),
+        batch_size=chunk_size,
+        jobs=jobs,
+        binary=binary,
+        progress=progress,
+    )
+    if verbose:
+        import json
+
+        progress.done()
+        seconds = time.time() - progress.start
+        stats = clean.stats()
+        stats["seconds"] = round(seconds, 3)
+        stats["lines_per_second"] = round(clean.line_count / seconds)
+        stats["megabytes_per_second"] = round(clean.byte_count / seconds / 1e6, 2)
+        print(json.dumps(stats, indent=2), file=sys.stderr)
 
 
 
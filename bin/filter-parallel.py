@@ -14,14 +14,23 @@
 
 import sys
 import os.path
-from argparse import ArgumentParser, FileType, Action
+import keyword
+import operator
+import re
+from argparse import ArgumentParser, FileType, Action, ArgumentTypeError
+from array import array
+from itertools import compress, islice
 
 from portage_utils import (
-   open,
+   fatal_error,
    printCopyright,
    DebugAction,
    HelpAction,
    VerboseAction,
+   Progress,
+   ParallelReader,
+   ParallelWriter,
+   ParallelLengthError,
 )
 
 
@@ -31,6 +40,121 @@ class Op(object):
    ge = 2
    lt = 3
    le = 4
+   top = 5
+   bottom = 6
+   expr = 7
+
+def rank_type(value):
+   """Parse the argument of -top/-bottom: a number of lines, or a percentage ending in %."""
+   try:
+      if value.endswith("%"):
+         percent = float(value[:-1])
+         if 0 <= percent <= 100:
+            return (percent, "%")
+      elif int(value) >= 0:
+         return (int(value), "")
+   except ValueError:
+      pass
+   raise ArgumentTypeError("expected a number of lines N or a percentage N%, got '{0}'".format(value))
+
+class ScoreFilter(object):
+   """Filter expression over the columns of a scores file, e.g., "c1 > 0.8 and c2 >= 0.5".
+
+   The expression is parsed once, checked against a small whitelist of
+   syntax (numbers, column names, comparisons, arithmetic, and/or/not,
+   abs/min/max), and compiled into a list comprehension that evaluates it
+   for a whole batch of score lines at a time.
+
+   expression: the filter expression; column i (1-based) is called ci
+   names: optional names for columns 1, 2, ..., usable in expression
+   raises: ValueError if expression is invalid or uses unknown columns
+   """
+   functions = {"abs": abs, "min": min, "max": max}
+   # Names the compiled list comprehension uses itself, see __init__
+   reserved_names = ("columns", "bool", "zip")
+
+   def __init__(self, expression, names=()):
+      import ast  # takes ~10 ms to import, and only -expr needs it
+      allowed_nodes = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not,
+                       ast.USub, ast.UAdd, ast.Compare, ast.Gt, ast.GtE, ast.Lt, ast.LtE,
+                       ast.Eq, ast.NotEq, ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div,
+                       ast.Name, ast.Load, ast.Constant, ast.Call)
+      if sys.version_info < (3, 8):
+         # Python 3.7 parses numbers as ast.Num, deprecated since 3.8
+         allowed_nodes += (ast.Num,)
+      for name in names:
+         if not name.isidentifier() or keyword.iskeyword(name) or name in self.functions \
+            or name in self.reserved_names or name.startswith("_") or re.match(r"c\d+$", name):
+            raise ValueError("invalid column name: '{0}'".format(name))
+      try:
+         tree = ast.parse(expression.strip(), mode="eval")
+      except SyntaxError as e:
+         raise ValueError("invalid filter expression '{0}': {1}".format(expression, e.msg))
+      called = set()
+      variables = {}
+      for node in ast.walk(tree):
+         if not isinstance(node, allowed_nodes):
+            raise ValueError("{0} not allowed in filter expression '{1}'".format(
+               type(node).__name__, expression))
+         if isinstance(node, ast.Constant) and \
+            (isinstance(node.value, bool) or not isinstance(node.value, (int, float))):
+            raise ValueError("{0!r} not allowed in filter expression '{1}'".format(
+               node.value, expression))
+         if sys.version_info < (3, 8) and isinstance(node, ast.Num) and \
+            not isinstance(node.n, (int, float)):
+            raise ValueError("{0!r} not allowed in filter expression '{1}'".format(
+               node.n, expression))
+         if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in self.functions \
+               or node.keywords:
+               raise ValueError("only abs(), min() and max() can be called in filter expression '{0}'"
+                                .format(expression))
+            called.add(node.func)
+         elif isinstance(node, ast.Name) and node not in called:
+            match = re.match(r"c(\d+)$", node.id)
+            if match and int(match.group(1)) >= 1:
+               variables[node.id] = int(match.group(1)) - 1
+            elif node.id in names:
+               variables[node.id] = list(names).index(node.id)
+            else:
+               raise ValueError("unknown column '{0}' in filter expression '{1}'".format(
+                  node.id, expression))
+      if not variables:
+         raise ValueError("filter expression '{0}' uses no score column".format(expression))
+
+      self.expression = expression
+      self.variables = sorted(variables)
+      self.columns = [variables[v] for v in self.variables]
+      self.min_fields = max(self.columns) + 1
+      # Equivalent to: lambda columns: [bool(<expression>) for (<variables>,) in zip(*columns)]
+      template = ast.parse("lambda columns: [bool(_) for ({0},) in zip(*columns)]".format(
+         ", ".join(self.variables)), mode="eval")
+      template.body.body.elt.args[0] = tree.body
+      self.evaluate = eval(compile(ast.fix_missing_locations(template), "<filter expression>", "eval"),
+                           {"__builtins__": {}, "bool": bool, "zip": zip, **self.functions})
+
+   def __call__(self, lines, first_line=1):
+      """Return a list of booleans selecting the score lines that pass the filter.
+
+      first_line: line number of lines[0], for error messages
+      """
+      fields = [line.split() for line in lines]
+      for i, line_fields in enumerate(fields):
+         if len(line_fields) < self.min_fields:
+            raise ValueError("line {0} has {1} score columns, but the filter uses column {2}".format(
+               first_line + i, len(line_fields), self.min_fields))
+      by_column = list(zip(*fields))
+      try:
+         return self.evaluate([list(map(float, by_column[i])) for i in self.columns])
+      except (ArithmeticError, ValueError):
+         # Evaluate the lines one at a time to report the one in error, e.g., c1 / c2 with c2 == 0
+         for i, line_fields in enumerate(fields):
+            try:
+               self.evaluate([[float(line_fields[c])] for c in self.columns])
+            except (ArithmeticError, ValueError) as e:
+               raise ValueError("line {0}: cannot evaluate filter expression '{1}': {2}".format(
+                  first_line + i, self.expression, e))
+         raise
 
 class OpAction(Action):
    """A custom action is needed to store both the operator and threshold."""
@@ -47,9 +171,12 @@ def get_args():
    help="""
    Filter lines in parallel from multiple line-aligned files according to
    a score in the provided <scores_file>, removing those lines whose score fails
-   to satisfy a specified threshold test. Write output to <in_file*><ext>, where
-   <ext> defaults to .filt. Any number of files can be filtered in parallel.
+   to satisfy a specified threshold test, or keeping only the lines with the
+   highest or lowest scores. With -expr, <scores_file> can have several
+   whitespace-separated score columns, combined in a single filter expression.
+   Write output to <in_file*><ext>, where <ext> defaults to .filt. Any number of files can be filtered in parallel.
    All files, including the scores file, must contain the same number of lines.
+   Uses NumPy, if installed, to select the highest or lowest scores.
    """
 
    # Use the argparse module, not the deprecated optparse module.
@@ -62,6 +189,8 @@ def get_args():
 
    parser.add_argument("-ext", dest="ext", type=str, default=".filt",
                        help="extension for output files [%(default)s]")
+   parser.add_argument("-names", dest="names", type=str, default="", metavar="NAME1,NAME2,...",
+                       help="names of the score columns, for use in -expr [none]")
 
    grp_op = parser.add_argument_group("Threshold operator selection options (one required)")
    ops = grp_op.add_mutually_exclusive_group(required=True)
@@ -73,41 +202,142 @@ def get_args():
                     metavar="THRESHOLD", help='''Keep if less than threshold''')
    ops.add_argument('-le', dest="op", action=OpAction, const=Op.le, type=float,
                     metavar="THRESHOLD", help='''Keep if less than or equal to threshold''')
+   ops.add_argument('-top', dest="op", action=OpAction, const=Op.top, type=rank_type,
+                    metavar="N[%]", help='''Keep the N lines with the highest scores, or the N%%
+                    of lines with the highest scores; ties are kept in file order''')
+   ops.add_argument('-bottom', dest="op", action=OpAction, const=Op.bottom, type=rank_type,
+                    metavar="N[%]", help='''Keep the N lines, or N%% of lines, with the lowest scores''')
+   ops.add_argument('-expr', dest="op", action=OpAction, const=Op.expr, type=str,
+                    metavar="EXPR", help='''Keep if EXPR is true, where EXPR is an expression over
+                    score columns c1, c2, ... or their -names, using numbers, comparisons,
+                    + - * /, and, or, not, abs(), min() and max(),
+                    e.g., "c1 > 0.8 and c2 >= 0.5"''')
 
    parser.add_argument("scores_file", type=FileType('r', encoding="utf8"),
-                       help="files to strip lines from in parallel")
+                       help="file of scores to use for filtering")
 
    parser.add_argument("in_files", nargs="+", type=FileType('r', encoding="utf8"),
-                       help="file of scores to use for filtering")
+                       help="files to strip lines from in parallel")
 
    try:
       cmd_args = parser.parse_args()
    except IOError as e:
       fatal_error("cannot open: '{0}': {1}".format(e.filename, e))
 
+   if cmd_args.names and cmd_args.op is not Op.expr:
+      fatal_error("-names can only be used with -expr")
+   if cmd_args.op is Op.expr:
+      try:
+         cmd_args.op_threshold = ScoreFilter(cmd_args.op_threshold,
+                                             cmd_args.names.split(",") if cmd_args.names else ())
+      except ValueError as e:
+         fatal_error(e)
+
    return cmd_args
 
+def import_numpy():
+   """Return the numpy module, or None if it is not installed.
+
+   NumPy is optional, and only imported for -top/-bottom, where np.partition()
+   finds the k-th score much faster than sorting; thresholds are faster to
+   apply without it.
+   """
+   try:
+      import numpy
+      return numpy
+   except ImportError:
+      return None
+
+def read_scores(scores_file, np=None, batch_size=10000):
+   """Read all the scores in scores_file into a NumPy array, or an array('d')."""
+   if np is None:
+      return array('d', map(float, scores_file))
+   batches = iter(lambda: list(islice(scores_file, batch_size)), [])
+   return np.concatenate([np.array(batch, dtype=float) for batch in batches] or [np.empty(0)])
+
+def rank_mask(scores, k, highest, np=None):
+   """Return a list of booleans selecting the k highest or lowest scores.
+
+   Ties at the k-th score are broken in favour of earlier lines, so exactly
+   min(k, len(scores)) lines are selected.
+   """
+   n = len(scores)
+   if k >= n:
+      return [True] * n
+   if k <= 0:
+      return [False] * n
+   if np is None:
+      kth = sorted(scores, reverse=highest)[k-1]
+      mask = list(map(kth.__lt__ if highest else kth.__gt__, scores))
+      ties = k - sum(mask)
+      for i, score in enumerate(scores):
+         if ties == 0:
+            break
+         if score == kth:
+            mask[i] = True
+            ties -= 1
+      return mask
+   keys = -scores if highest else scores
+   kth = np.partition(keys, k-1)[k-1]
+   mask = keys < kth
+   ties = np.flatnonzero(keys == kth)[:k - np.count_nonzero(mask)]
+   mask[ties] = True
+   return mask.tolist()
+
+def threshold_mask(scores, op, threshold):
+   """Return a list of booleans selecting the score lines whose score passes
+   op(score, threshold).
+   """
+   # threshold.__le__(score) is score >= threshold, etc.: applying the
+   # reflected comparison with map() avoids a Python-level call per line.
+   reflected = {operator.gt: threshold.__lt__, operator.ge: threshold.__le__,
+                operator.lt: threshold.__gt__, operator.le: threshold.__ge__}[op]
+   return list(map(reflected, map(float, scores)))
+
 def main():
    printCopyright("filter-parallel.py", 2015);
 
    cmd_args = get_args()
-   out_files = tuple(open(f.name+cmd_args.ext, 'w', encoding="utf_8") for f in cmd_args.in_files)
-
-   for score_line in cmd_args.scores_file:
-      score = float(score_line)
-      lines = []
-      for f in cmd_args.in_files:
-         lines.append(f.readline())
-      if cmd_args.op is Op.gt and score > cmd_args.op_threshold or \
-         cmd_args.op is Op.ge and score >= cmd_args.op_threshold or \
-         cmd_args.op is Op.lt and score < cmd_args.op_threshold or \
-         cmd_args.op is Op.le and score <= cmd_args.op_threshold:
-            for i in range(len(lines)):
-               print(lines[i], file=out_files[i], end='')
-
-   for f in cmd_args.in_files:
-      if len(f.readline()) != 0:
-         fatal_error("File", f.name, "contains more lines than some other files.")
+   out_files = [f.name+cmd_args.ext for f in cmd_args.in_files]
+   progress = Progress("filter-parallel.py", total_bytes=Progress.input_size(
+      cmd_args.scores_file.name, *(f.name for f in cmd_args.in_files)))
+
+   try:
+      if cmd_args.op in (Op.top, Op.bottom):
+         # Ranking needs all the scores: read them first, then stream the text files.
+         np = import_numpy()
+         scores = read_scores(cmd_args.scores_file, np)
+         progress.total_bytes = Progress.input_size(*(f.name for f in cmd_args.in_files))
+         rank, unit = cmd_args.op_threshold
+         k = int(len(scores) * rank / 100 + 0.5) if unit == "%" else rank
+         mask = rank_mask(scores, k, cmd_args.op is Op.top, np)
+         with ParallelReader(cmd_args.in_files, progress=progress) as reader, \
+              ParallelWriter(out_files) as writer:
+            for columns in reader.batches():
+               if reader.line_count > len(mask):
+                  raise ParallelLengthError("{0} has {1} lines, but {2} has more".format(
+                     cmd_args.scores_file.name, len(mask), cmd_args.in_files[0].name))
+               keep = mask[reader.line_count - len(columns[0]):reader.line_count]
+               writer.write_columns([compress(column, keep) for column in columns])
+         if reader.line_count < len(mask):
+            raise ParallelLengthError("{0} has {1} lines, but {2} has more".format(
+               cmd_args.in_files[0].name, reader.line_count, cmd_args.scores_file.name))
+      else:
+         if cmd_args.op is Op.expr:
+            score_filter = cmd_args.op_threshold
+         else:
+            op = {Op.gt: operator.gt, Op.ge: operator.ge, Op.lt: operator.lt, Op.le: operator.le}[cmd_args.op]
+            score_filter = lambda scores, first_line: threshold_mask(scores, op, cmd_args.op_threshold)
+         with ParallelReader([cmd_args.scores_file] + cmd_args.in_files, progress=progress) as reader, \
+              ParallelWriter(out_files) as writer:
+            for columns in reader.batches():
+               keep = score_filter(columns[0], reader.line_count - len(columns[0]) + 1)
+               writer.write_columns([compress(column, keep) for column in columns[1:]])
+   except ParallelLengthError as e:
+      fatal_error(e)
+   except ValueError as e:
+      fatal_error("{0}: {1}".format(cmd_args.scores_file.name, e))
+   progress.done()
 
 if __name__ == '__main__':
    main()
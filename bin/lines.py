@@ -13,44 +13,138 @@
 # Copyright 2008, Sa Majeste la Reine du Chef du Canada /
 # Copyright 2008, Her Majesty in Right of Canada
 
-import gzip
+import heapq
 import io
+import os
 import sys
-from portage_utils import open
+from array import array
+from itertools import chain, islice
+from portage_utils import open, load_line_index, select_lines, Progress
 
-if len(sys.argv) != 3:
-    sys.stderr.write("Usage: lines.py  \n\
+usage = "Usage: lines.py  [-v] [-M max_in_memory]\n\
     <file containing line numbers>  <file containing text (can be gzipped)>\n\n\
     Extracts lines specified in first file from second file.\n\
     Line numbers have to start with 1 (not 0) and may contain repetitions.\n\
-    Output will be sorted by line numbers.\n\
-")
-    sys.exit(1)
+    Output will be sorted by line numbers.\n\n\
+    If the text has a line index built by build-line-index.py, it is used to\n\
+    jump directly to the lines.  For a .gz text, this only helps if it has many\n\
+    gzip members, e.g., if it was written with PORTAGE_GZIP_THREADS set or by\n\
+    bgzip: an ordinary single-member .gz file is still read from the start.\n\n\
+    Only \"\\n\" ends a line, with or without a line index: a \"\\r\", e.g., of a\n\
+    CRLF line ending, is part of the line it is on.  Older versions also ended\n\
+    lines at \"\\r\", and so numbered lines differently in files containing one.\n\n\
+    -v  Report progress on stderr.\n\
+    -M  Sort at most this many line numbers in memory at a time; beyond that,\n\
+        sorted runs are spilled to temporary files and merged. [5000000]\n\
+"
 
-### Read arguments
 encoding = "utf-8"
-numFile = open(sys.argv[1], mode="rt", encoding=encoding)
-txtFile = open(sys.argv[2], mode="rt", encoding=encoding)
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding=encoding)
-
-### Read line numbers
-nums = sorted([int(line.strip()) for line in numFile])
-
-### read text and extract lines
-n1 = 1
-n2 = nums.pop(0)
-line = txtFile.readline()
-done = False
-while (line != "") and (not done):
-    #print("%",n1,n2)
-    while n1 == n2:
-        #sys.stderr.write("Line %i: %s\n" % (n2,line))
-        #sys.stdout.write(str(line))
-        print(line, end='')
-        if len(nums) == 0:
-            done = True
+block_size = 1 << 16    # line numbers read/written at a time from/to run files
+
+
+def usage_error():
+    sys.stderr.write(usage)
+    sys.exit(1)
+
+
+def read_runs(numFile, max_in_memory):
+    """Yield the line numbers in numFile as sorted runs of up to max_in_memory numbers."""
+    numbers = (int(line) for line in numFile)
+    while True:
+        run = array("q", sorted(islice(numbers, max_in_memory)))
+        if not run:
             break
-        n2 = nums.pop(0)
-    #print("#", n1, line, end=' ')
-    n1 = n1+1
-    line = txtFile.readline()
+        if run[0] < 1:
+            sys.stderr.write("lines.py: line numbers have to start with 1, got %d\n" % run[0])
+            sys.exit(1)
+        yield run
+
+
+def merge_spilled_runs(runs):
+    """Write each run to a file in a temporary directory as soon as it is complete,
+    then yield the numbers of all the runs, merged in increasing order.
+    """
+    # Only imported here, because it takes about as long as the rest of lines.py to import
+    import tempfile
+    with tempfile.TemporaryDirectory(prefix="lines.py.") as tmp_dir:
+        filenames = []
+        for run in runs:
+            filenames.append(os.path.join(tmp_dir, "run%d" % (len(filenames) + 1)))
+            with io.open(filenames[-1], "wb") as f:
+                run.tofile(f)
+        yield from heapq.merge(*map(read_run_file, filenames))
+
+
+def read_run_file(filename):
+    """Yield the numbers in a run file, reading them one block at a time."""
+    with io.open(filename, "rb") as f:
+        while True:
+            block = array("q")
+            try:
+                block.fromfile(f, block_size)
+            except EOFError:
+                # fromfile() raises EOFError on a partial block, but keeps it
+                pass
+            if not block:
+                break
+            yield from block
+
+
+def sorted_numbers(numFile, max_in_memory):
+    """Yield the line numbers in numFile in increasing order, repeats included.
+
+    If there are more than max_in_memory of them, they are sorted in runs
+    which are spilled to temporary files and merged.
+    """
+    runs = read_runs(numFile, max_in_memory)
+    run = next(runs, array("q"))
+    if len(run) < max_in_memory:
+        return iter(run)
+    return merge_spilled_runs(chain([run], runs))
+
+
+def main():
+    args = sys.argv[1:]
+    max_in_memory = 5000000
+    verbose = False
+    while len(args) > 2 and args[0] in ("-v", "-M"):
+        if args[0] == "-v":
+            verbose = True
+            args = args[1:]
+            continue
+        try:
+            max_in_memory = int(args[1])
+        except ValueError:
+            usage_error()
+        if max_in_memory < 1:
+            usage_error()
+        args = args[2:]
+    if len(args) != 2:
+        usage_error()
+    numFilename, txtFilename = args
+
+    numFile = open(numFilename, mode="rt", encoding=encoding)
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding=encoding)
+
+    nums = sorted_numbers(numFile, max_in_memory)
+
+    # Jump directly to the lines if the text has a line index (see build-line-index.py),
+    # otherwise merge the sorted line numbers with a single pass over the text.
+    lineIndex = load_line_index(txtFilename) if txtFilename != "-" else None
+    if lineIndex is not None:
+        lines = lineIndex.select(nums)
+    else:
+        lines = select_lines(open(txtFilename, mode="rt", encoding=encoding, newline="\n"), nums)
+
+    progress = Progress("lines.py", enabled=verbose)
+    try:
+        sys.stdout.writelines(progress.watch(lines) if verbose else lines)
+    except IndexError:
+        # Line numbers beyond the end of the text are ignored
+        pass
+    progress.done()
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
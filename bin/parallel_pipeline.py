@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+# @file parallel_pipeline.py
+# @brief Run clean_utf8.py, filter-parallel.py, strip-parallel-blank-lines.py,
+# strip-parallel-duplicates.py and select-lines.py as stages of a single
+# process on line-aligned files.
+#
+# Traitement multilingue de textes / Multilingual Text Processing
+# Centre de recherche en technologies numériques / Digital Technologies Research Centre
+# Conseil national de recherches Canada / National Research Council Canada
+# Copyright 2026, Sa Majeste le Roi du Chef du Canada /
+# Copyright 2026, His Majesty the King in Right of Canada
+
+import os
+from abc import ABC, abstractmethod
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from itertools import compress
+
+from portage_utils import (
+   fatal_error,
+   open,
+   printCopyright,
+   verbose,
+   DebugAction,
+   HelpAction,
+   VerboseAction,
+   ParallelLengthError,
+   ParallelReader,
+   ParallelWriter,
+   Progress,
+)
+
+
+_scripts = {}
+
+def load_script(name):
+   """Import name, a script in the same directory as this one whose name,
+   e.g., filter-parallel.py, is not a valid module name.
+   """
+   if name not in _scripts:
+      import importlib.util
+      path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+      spec = importlib.util.spec_from_file_location(name[:-3].replace("-", "_"), path)
+      module = importlib.util.module_from_spec(spec)
+      spec.loader.exec_module(module)
+      _scripts[name] = module
+   return _scripts[name]
+
+
+class Stage(ABC):
+   """A pipeline stage: a callable that takes an iterator over batches of
+   line-aligned lines, as yielded by ParallelReader.batches(), i.e., one list
+   of lines per file, and yields the resulting batches.
+
+   files: 1-based numbers of the files the stage looks at, or None for the
+      stage's default
+   """
+   def __init__(self, files=None):
+      self.files = None if files is None else list(files)
+
+   def default_files(self, num_files):
+      """Return the files to look at when none are given."""
+      return list(range(1, num_files + 1))
+
+   def check(self, num_files):
+      """Resolve and check the files looked at, for a pipeline on num_files files.
+
+      raises: ValueError if some of them don't exist
+      """
+      if self.files is None:
+         self.files = self.default_files(num_files)
+      for n in self.files:
+         if not isinstance(n, int) or not 1 <= n <= num_files:
+            raise ValueError("{0}: no file {1!r} in a pipeline on {2} files".format(
+               type(self).__name__, n, num_files))
+      self.columns = [n - 1 for n in self.files]
+
+   @abstractmethod
+   def __call__(self, batches):
+      """Yield the batches resulting from this stage on batches."""
+
+
+class KeepStage(Stage):
+   """A stage that only decides which lines to keep, with keep(); it always
+   keeps the same files, whether it looks at them or not.
+   """
+   @abstractmethod
+   def keep(self, columns, first_line):
+      """Return a list of booleans selecting the lines to keep in the batch
+      columns, whose first line is line first_line of the stage's input.
+      """
+
+   def __call__(self, batches):
+      line_count = 0
+      for columns in batches:
+         keep = self.keep(columns, line_count + 1)
+         line_count += len(columns[0])
+         yield [list(compress(column, keep)) for column in columns]
+
+
+class Clean(Stage):
+   """Clean lines like clean_utf8.py does, in all files by default.
+
+   The options are those of clean_utf8.CleanUTF8, and cache_mb is -c/--cache.
+   """
+   def __init__(self, files=None, wide_punct=False, phrase_table=False, extended=False,
+                normalize=None, cache_mb=0):
+      Stage.__init__(self, files)
+      from clean_utf8 import CleanUTF8
+      self.clean = CleanUTF8(wide_punct=wide_punct, phrase_table=phrase_table,
+                             extended_crtl_character_filtering=extended,
+                             normalization_type=normalize, cache_memory=int(cache_mb * 1e6))
+
+   def __call__(self, batches):
+      clean_list = self.clean.clean_list
+      for columns in batches:
+         columns = list(columns)
+         for i in self.columns:
+            columns[i] = [line + "\n" for line in clean_list([line.strip() for line in columns[i]])]
+         yield columns
+
+
+class FilterScores(KeepStage):
+   """Keep the lines whose score passes a threshold or an expression, like
+   filter-parallel.py does, with the scores in file number scores.
+
+   op: gt, ge, lt or le, comparing the score with threshold
+   expr: a filter expression over the columns of the scores file, as with
+      filter-parallel.py -expr, instead of op and threshold; names gives
+      names to its columns, as with -names.
+
+   Ranking with -top and -bottom needs all the scores before any line can
+   be kept, so it has no equivalent here.
+   """
+   def __init__(self, scores, op="ge", threshold=None, expr=None, names=()):
+      Stage.__init__(self, [scores])
+      filter_parallel = load_script("filter-parallel.py")
+      if expr is not None:
+         self.score_filter = filter_parallel.ScoreFilter(expr, names)
+      else:
+         import operator
+         if op not in ("gt", "ge", "lt", "le"):
+            raise ValueError("FilterScores: op must be gt, ge, lt or le, not {0!r}".format(op))
+         if not isinstance(threshold, (int, float)):
+            raise ValueError("FilterScores: a numeric threshold is required with op")
+         op, threshold = getattr(operator, op), float(threshold)
+         threshold_mask = filter_parallel.threshold_mask
+         self.score_filter = lambda scores, first_line: threshold_mask(scores, op, threshold)
+
+   def keep(self, columns, first_line):
+      return self.score_filter(columns[self.columns[0]], first_line)
+
+
+class StripBlank(KeepStage):
+   """Strip the lines where any of the files looked at, by default the first
+   two, has a blank line, like strip-parallel-blank-lines.py does.
+   """
+   def default_files(self, num_files):
+      return [1, 2][:num_files]
+
+   def keep(self, columns, first_line):
+      return list(map(all, zip(*(map(str.strip, columns[i]) for i in self.columns))))
+
+
+class Dedup(KeepStage):
+   """Strip duplicates like strip-parallel-duplicates.py does, comparing
+   the files looked at, by default the first two.
+
+   By default, strip the lines where the files looked at have identical
+   lines; with global_dedup, like -g, the lines whose compared lines, taken
+   together, occurred on an earlier line instead; with near, like -near,
+   their near-duplicates too.  bits, shingle, words, permutations and
+   normalize are the options of the same names.
+   """
+   def __init__(self, files=None, global_dedup=False, bits=64, near=None, shingle=5,
+                words=False, permutations=64, normalize=False):
+      Stage.__init__(self, files)
+      dedup = load_script("strip-parallel-duplicates.py")
+      self.seen = self.near = None
+      if near is not None:
+         if global_dedup:
+            raise ValueError("Dedup: near and global_dedup cannot be combined")
+         try:
+            import numpy
+         except ImportError:
+            raise ValueError("Dedup: near requires NumPy: pip3 install numpy")
+         self.near = dedup.NearDuplicateFilter(numpy, near, shingle, words, permutations,
+                                               dedup.normalizer() if normalize else None)
+      elif global_dedup:
+         if bits not in (64, 128):
+            raise ValueError("Dedup: bits must be 64 or 128")
+         self.bits = bits
+         self.seen = dedup.HashSet(bits)
+         self.row_hashes = dedup.row_hashes
+
+   def default_files(self, num_files):
+      return [1, 2][:num_files]
+
+   def check(self, num_files):
+      Stage.check(self, num_files)
+      if self.seen is None and self.near is None and len(self.files) < 2:
+         raise ValueError("Dedup: at least 2 files must be compared, "
+                          "or 1 with global_dedup or near")
+
+   def keep(self, columns, first_line):
+      compared = [columns[i] for i in self.columns]
+      if self.near is not None:
+         return self.near(compared)
+      if self.seen is not None:
+         return self.seen.add_all(self.row_hashes(compared, self.bits))
+      return [lines.count(lines[0]) != len(lines) for lines in zip(*compared)]
+
+
+class Select(KeepStage):
+   """Keep the lines whose numbers are in index, like select-lines.py does:
+   index is a file of strictly increasing 1-based line numbers, which refer
+   to the lines reaching this stage.
+   """
+   def __init__(self, index):
+      Stage.__init__(self, [])
+      self.index = index
+
+   def check(self, num_files):
+      Stage.check(self, num_files)
+      # Report a missing index before any output is written; it is only opened
+      # when the pipeline runs, so it can't leak if another stage is invalid.
+      os.stat(self.index)
+
+   def __call__(self, batches):
+      with open(self.index) as index_file:
+         self.numbers = map(self.parse_index, index_file)
+         self.next_number = next(self.numbers, None)
+         self.previous = 0
+         for columns in KeepStage.__call__(self, batches):
+            yield columns
+         if self.next_number is not None:
+            raise IndexError("Out of input before end of index file {0} at index: {1}".format(
+               self.index, self.next_number))
+
+   def parse_index(self, line):
+      try:
+         return int(line)
+      except ValueError:
+         raise ValueError("Invalid index in index file {0}: {1}".format(self.index, line.strip()))
+
+   def keep(self, columns, first_line):
+      end = first_line + len(columns[0])
+      keep = [False] * len(columns[0])
+      while self.next_number is not None and self.next_number < end:
+         if self.next_number <= self.previous:
+            raise ValueError("Index file {0} out of sort order at index: {1} after index: {2}"
+                             .format(self.index, self.next_number, self.previous))
+         keep[self.next_number - first_line] = True
+         self.previous = self.next_number
+         self.next_number = next(self.numbers, None)
+      return keep
+
+
+# Stage names in pipeline specs
+STAGES = {
+   "clean": Clean,
+   "filter": FilterScores,
+   "strip-blank": StripBlank,
+   "dedup": Dedup,
+   "select": Select,
+}
+
+
+def make_stages(stages, num_files):
+   """Return the Stage objects for stages, for a pipeline on num_files files.
+
+   stages: list of Stage objects, or of dicts giving a stage name from
+      STAGES as "stage" and the stage's options by name
+   raises: ValueError if a stage is unknown or has invalid options
+   """
+   result = []
+   for i, stage in enumerate(stages, 1):
+      if not isinstance(stage, Stage):
+         options = dict(stage)
+         name = options.pop("stage", None)
+         if name not in STAGES:
+            raise ValueError("stage {0}: unknown stage {1!r}; known stages: {2}".format(
+               i, name, ", ".join(STAGES)))
+         import inspect  # takes ~10 ms to import, and only specs by name need it
+         try:
+            inspect.signature(STAGES[name]).bind(**options)
+         except TypeError as e:
+            raise ValueError("stage {0} ({1}): {2}".format(i, name, e))
+         stage = STAGES[name](**options)
+      stage.check(num_files)
+      result.append(stage)
+   return result
+
+
+def run_pipeline(spec, progress=None):
+   """Run the pipeline described by spec, a dict, e.g., loaded from JSON:
+
+      {"inputs": ["corpus.en", "corpus.fr", "corpus.scores"],
+       "outputs": ["out.en", "out.fr", null],
+       "stages": [{"stage": "clean", "files": [1, 2]},
+                  {"stage": "filter", "scores": 3, "op": "ge", "threshold": 0.5},
+                  {"stage": "strip-blank"},
+                  {"stage": "dedup", "global_dedup": true},
+                  {"stage": "select", "index": "sample.idx"}]}
+
+   The inputs are read in lockstep, each batch of lines goes through each
+   stage in turn, and the lines that come out are written to the outputs;
+   an input whose output is null is used by the stages, but not written.
+
+   progress: a portage_utils.Progress updated as the inputs are read
+   return: the number of lines read, and the number of lines written
+   raises: ValueError if spec is invalid, OSError if a file cannot be
+      opened, ParallelLengthError if the inputs don't have the same number of
+      lines, and IndexError if an index file has numbers beyond the end of
+      its input
+   """
+   inputs = spec.get("inputs")
+   outputs = spec.get("outputs")
+   if not inputs or not all(isinstance(f, str) for f in inputs):
+      raise ValueError("inputs must be a non-empty list of filenames")
+   if not isinstance(outputs, list) or len(outputs) != len(inputs) \
+      or not all(f is None or isinstance(f, str) for f in outputs) or outputs == [None] * len(inputs):
+      raise ValueError("outputs must list a filename or null for each input, "
+                       "with at least one filename")
+   stages = make_stages(spec.get("stages", []), len(inputs))
+   written = [i for i, f in enumerate(outputs) if f is not None]
+
+   line_count = 0
+   # Only "\n" ends a line, as in clean_utf8.py, which cleans up any other line break.
+   with ParallelReader(inputs, progress=progress, newline="\n") as reader, \
+        ParallelWriter([outputs[i] for i in written]) as writer:
+      batches = reader.batches()
+      for stage in stages:
+         batches = stage(batches)
+      for columns in batches:
+         writer.write_columns([columns[i] for i in written])
+         line_count += len(columns[0])
+   return reader.line_count, line_count
+
+
+def get_args():
+   """Command line argument processing."""
+
+   usage = "parallel_pipeline.py [options] spec.json"
+   help = """
+   Run a pipeline of clean_utf8.py, filter-parallel.py, strip-parallel-blank-lines.py,
+   strip-parallel-duplicates.py and select-lines.py stages over line-aligned files in a
+   single process, decoding the inputs and encoding the outputs just once instead of at
+   every stage of a shell pipeline.
+
+   spec.json describes the inputs, outputs and stages, e.g.:
+
+      {"inputs": ["corpus.en", "corpus.fr", "corpus.scores"],
+       "outputs": ["out.en", "out.fr", null],
+       "stages": [{"stage": "clean", "files": [1, 2]},
+                  {"stage": "filter", "scores": 3, "op": "ge", "threshold": 0.5},
+                  {"stage": "strip-blank"},
+                  {"stage": "dedup", "global_dedup": true},
+                  {"stage": "select", "index": "sample.idx"}]}
+
+   Files are numbered from 1 in the order of the inputs; a null output means the input
+   is used by the stages, e.g., for scores, but not written.  Every stage keeps or
+   strips whole lines of all the files at once.
+
+   Stages and their options, with the equivalent script options:
+      clean:       files [all], wide_punct, phrase_table, extended (-x), normalize (-n),
+                   cache_mb (-c)
+      filter:      scores (the scores file), op (gt, ge, lt, le) and threshold, or
+                   expr (-expr) and names (-names)
+      strip-blank: files [1, 2]
+      dedup:       files [1, 2], global_dedup (-g), bits, near, shingle, words,
+                   permutations (-perm), normalize
+      select:      index (sorted index file, numbering the lines reaching the stage)
+   """
+
+   parser = ArgumentParser(usage=usage, description=help,
+                           formatter_class=RawDescriptionHelpFormatter, add_help=False)
+   parser.add_argument("-h", "-help", "--help", action=HelpAction)
+   parser.add_argument("-v", "--verbose", action=VerboseAction)
+   parser.add_argument("-d", "--debug", action=DebugAction)
+   parser.add_argument("spec", type=str, help="pipeline specification, in JSON")
+
+   return parser.parse_args()
+
+
+def main():
+   printCopyright("parallel_pipeline.py", 2026)
+   os.environ['PORTAGE_INTERNAL_CALL'] = '1'
+
+   cmd_args = get_args()
+
+   import json
+   try:
+      with open(cmd_args.spec) as f:
+         spec = json.load(f)
+   except ValueError as e:
+      fatal_error("Invalid JSON in", cmd_args.spec + ":", e)
+   if not isinstance(spec, dict):
+      fatal_error(cmd_args.spec, "must contain a JSON object")
+
+   progress = Progress("parallel_pipeline.py", total_bytes=Progress.input_size(
+      *[f for f in spec.get("inputs") or [] if isinstance(f, str)]))
+   try:
+      lines_read, lines_written = run_pipeline(spec, progress)
+   except ParallelLengthError as e:
+      fatal_error(e)
+   except (IOError, OSError) as e:
+      fatal_error("cannot open: '{0}': {1}".format(e.filename, e))
+   except (ValueError, IndexError) as e:
+      fatal_error(cmd_args.spec + ":", e)
+   progress.done()
+   verbose("Read", lines_read, "lines, wrote", lines_written)
+
+
+if __name__ == '__main__':
+   main()
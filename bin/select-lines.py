@@ -13,17 +13,23 @@
 # Copyright 2018, Her Majesty in Right of Canada
 
 import codecs
-import io
 import os
 import sys
+from array import array
+from itertools import chain, islice, tee, zip_longest
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
 from portage_utils import (
     fatal_error,
+    load_line_index,
     open,
     printCopyright,
+    select_lines,
+    verbose,
     DebugAction,
     HelpAction,
+    Progress,
+    TextLineIndex,
     VerboseAction,
 )
 
@@ -31,12 +37,34 @@ from portage_utils import (
 def get_args():
    """Command line argument processing."""
 
-   usage = "select-lines.py [options] indexfile [infile [outfile]]"
+   usage = "select-lines.py [options] indexfile [infile [outfile] [infile2 outfile2 ...]]"
    help = """
-   Select a set of lines by index from a file.
+   Select a set of lines by index from a file, or from several line-aligned
+   files at once.
 
    indexfile contains 1-based integer indicies of lines to be extracted.
    indexfile is assumed to be sorted.
+
+   If infile has a line index built by build-line-index.py, it is used to
+   jump directly to the selected lines instead of reading the whole file.
+   For a .gz infile, this only helps if it has many gzip members, e.g., if it
+   was written with PORTAGE_GZIP_THREADS set or by bgzip: an ordinary
+   single-member .gz file is still read from the start.
+
+   Only "\\n" ends a line, with or without a line index: a "\\r", e.g., of a
+   CRLF line ending, is part of the line it is on.  Older versions also ended
+   lines at "\\r", and so numbered lines differently in files containing one.
+
+   With -u, indexfile may be in any order and contain repeats, and lines are
+   output in indexfile order.  infile is still read in a single pass, keeping
+   only the selected lines in memory, or accessed directly through its line
+   index if it has one.
+
+   Several infile outfile pairs can be given to select the same lines from
+   line-aligned files, e.g., the source, target and scores of a parallel
+   corpus, reading the indexfile and all infiles just once.  The infiles
+   must all have the same number of lines.  With -a, the --joiner and
+   --separator apply to each outfile.
    """
 
    parser = ArgumentParser(usage=usage, description=help,
@@ -50,22 +78,27 @@ def get_args():
                        help="with -a, join lines in a range with given joiner [one space]")
    parser.add_argument("--separator", dest="separator", default="\n", type=str,
                        help="with -a, separate ranges with given separator [one newline]")
+   parser.add_argument("-u", "--unsorted", dest="unsorted", action="store_true", default=False,
+                       help="indexfile is not sorted and may have repeats; output lines in "
+                            "indexfile order [indexfile must be sorted]")
 
    parser.add_argument("indexfile",
                        type=lambda f: open(f, "r", encoding="utf-8"),
                        help="sorted index file")
 
-   parser.add_argument("infile", nargs='?',
-                       type=lambda f: open(f, "r", encoding="utf-8"),
-                       default=io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8"),
-                       help="input file [sys.stdin]")
-
-   parser.add_argument("outfile", nargs='?',
-                       type=lambda f: open(f, "w", encoding="utf-8"),
-                       default=io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8"),
-                       help="output file [sys.stdout]")
+   parser.add_argument("files", nargs='*', type=str, metavar="infile outfile",
+                       help="input file [sys.stdin] and output file [sys.stdout], "
+                            "or pairs of input and output files")
 
    cmd_args = parser.parse_args()
+   if cmd_args.unsorted and cmd_args.alignment_column != 0:
+      fatal_error("-u cannot be combined with -a.")
+
+   files = cmd_args.files
+   if len(files) > 2 and len(files) % 2 != 0:
+      fatal_error("With several input files, each one needs its own output file.")
+   cmd_args.infiles = files[0::2] or ["-"]
+   cmd_args.outfiles = files[1::2] or ["-"]
 
    return cmd_args
 
@@ -83,6 +116,60 @@ def parse_alignment_line(line, column):
    return (start, end)
 
 
+def parse_alignments(indexfile, column):
+   """Yield (start, end, index_line) for each alignment in indexfile, where
+   start and end delimit the 0-based half-open range of lines aligned.
+   """
+   previous_end = 0
+   for index_line in indexfile:
+      (start, end) = parse_alignment_line(index_line, column)
+      if start < 0:
+         fatal_error("Alignment file specifies negative line number at:", index_line.strip())
+      if start < previous_end:
+         fatal_error("Alignment file out of order at:", index_line.strip())
+      previous_end = end
+      yield (start, end, index_line)
+
+
+def sorted_indices(indexfile):
+   """Yield the indices in indexfile, which must be strictly increasing."""
+   previous = 0
+   for index_line in indexfile:
+      index = int(index_line)
+      if index <= previous:
+         fatal_error("Index file out of sort order at index:", index, "after index:", previous)
+      previous = index
+      yield index
+
+
+def read_indices(indexfile):
+   """Return the indices in indexfile, in any order, as a compact array."""
+   indices = array("q")
+   for index_line in indexfile:
+      index = int(index_line)
+      if index < 1:
+         fatal_error("Invalid index:", index)
+      indices.append(index)
+   return indices
+
+
+def aligned_lines(infiles):
+   """Yield tuples of lines read in lockstep from infiles, and make it a fatal
+   error for one file to be shorter than another.
+   """
+   if len(infiles) == 1:
+      for line in infiles[0]:
+         yield (line,)
+      return
+   for lines in zip_longest(*infiles):
+      if None in lines:
+         short = lines.index(None)
+         longer = next(i for i, line in enumerate(lines) if line is not None)
+         fatal_error("File", infiles[short].name, "contains fewer lines than",
+                     infiles[longer].name)
+      yield lines
+
+
 def main():
 
    printCopyright("select-lines.py", 2018)
@@ -91,70 +178,89 @@ def main():
    cmd_args = get_args()
 
    indexfile = cmd_args.indexfile
-   infile = cmd_args.infile
-   outfile = cmd_args.outfile
+   outfiles = [open(f, "w", encoding="utf-8") for f in cmd_args.outfiles]
 
    # The following allows stderr to handle non-ascii characters:
    sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
 
-   line_number = 0
-
-   if cmd_args.alignment_column == 0:
-      index_line = indexfile.readline()
-      if index_line:
-         index = int(index_line)
-
-      for in_line in infile:
-         if not index_line:
-            break
-         line_number += 1
-         if line_number == index:
-            print(in_line, file=outfile, end='')
-            index_line = indexfile.readline()
-            if index_line:
-               index = int(index_line)
-         elif line_number > index:
-            fatal_error("Index file out of sort order at index:", index, "input line:", line_number)
-
-      if index_line:
-         fatal_error("Out of input before end of index file at index:", index)
+   line_indices = [load_line_index(f) if f != "-" else None for f in cmd_args.infiles]
+   if None not in line_indices:
+      for f in cmd_args.infiles:
+         verbose("Using line index", f + ".lineidx")
+      for f, line_index in zip(cmd_args.infiles, line_indices):
+         if line_index.num_lines != line_indices[0].num_lines:
+            fatal_error("File", f, "has", line_index.num_lines, "lines but",
+                        cmd_args.infiles[0], "has", line_indices[0].num_lines)
+      select = lambda numbers: zip(*(line_index.select(numbers_copy) for line_index, numbers_copy
+                                     in zip(line_indices, tee(numbers, len(line_indices)))))
+      infiles = []
+   else:
+      line_indices = None
+      # Lines end at "\n" only, like with a line index, so that a stray "\r" does
+      # not shift the line numbers.
+      infiles = [open(f, "r", encoding="utf-8", newline="\n") for f in cmd_args.infiles]
+      aligned = aligned_lines(infiles)
+      select = lambda numbers: select_lines(aligned, numbers)
+
+   progress = Progress("select-lines.py")
+
+   def output(lines):
+      size = 0
+      for line, outfile in zip(lines, outfiles):
+         print(line, file=outfile, end='')
+         size += len(line)
+      progress.update(1, size)
+
+   if cmd_args.unsorted:
+      indices = read_indices(indexfile)
+      progress.total_lines = len(indices)
+      try:
+         if line_indices and all(isinstance(i, TextLineIndex) for i in line_indices):
+            # Random access is cheap, no need to keep lines in memory.
+            for index in indices:
+               output(line_index.get_line(index) for line_index in line_indices)
+         else:
+            numbers = sorted(set(indices))
+            lines = dict(zip(numbers, select(numbers)))
+            for index in indices:
+               output(lines[index])
+      except IndexError as e:
+         fatal_error("Out of input before end of index file at index:", e.args[0])
+
+   elif cmd_args.alignment_column == 0:
+      try:
+         for lines in select(sorted_indices(indexfile)):
+            output(lines)
+      except IndexError as e:
+         fatal_error("Out of input before end of index file at index:", e.args[0])
 
    elif cmd_args.alignment_column == 1 or cmd_args.alignment_column == 2:
-      col = cmd_args.alignment_column
-      index_line = indexfile.readline()
-      if index_line:
-         (start, end) = parse_alignment_line(index_line, col)
-         if start < 0:
-            fatal_error("Alignment file specifies negative line number at:", index_line.strip())
-
-      for in_line in infile:
-         if not index_line:
-            break
-         if line_number >= start and line_number < end:
-            print(in_line.strip('\n'), file=outfile, end='')
-            if line_number+1 < end:
-               print(cmd_args.joiner, file=outfile, end='')
-
-         line_number += 1
-         while line_number == end:
-            print(cmd_args.separator, file=outfile, end='')
-            index_line = indexfile.readline()
-            if index_line:
-               (start, end) = parse_alignment_line(index_line, col)
-               if start < line_number:
-                  fatal_error("Alignment file out of order at:", index_line.strip())
-            else:
-               break
-
-      if index_line:
-         fatal_error("Out of input before end of alignment index file at:", index_line.strip())
+      alignments, alignments_copy = tee(parse_alignments(indexfile, cmd_args.alignment_column))
+      lines = select(chain.from_iterable(range(start+1, end+1) for (start, end, _) in alignments_copy))
+      for (start, end, index_line) in alignments:
+         try:
+            selected = list(islice(lines, end - start))
+         except IndexError:
+            fatal_error("Out of input before end of alignment index file at:", index_line.strip())
+         progress.update(len(selected), sum(len(line) for lines in selected for line in lines))
+         for i, outfile in enumerate(outfiles):
+            print(cmd_args.joiner.join(lines[i].strip('\n') for lines in selected),
+                  file=outfile, end=cmd_args.separator)
 
    else:
       fatal_error("invalid -a/--alignment-column value: use 1 or 2 (or 0 for none).")
 
+   if len(infiles) > 1:
+      # Read to the end to make sure the input files are all the same length.
+      for _ in aligned:
+         pass
+   progress.done()
+
    indexfile.close()
-   infile.close()
-   outfile.close()
+   for infile in infiles:
+      infile.close()
+   for outfile in outfiles:
+      outfile.close()
 
 if __name__ == '__main__':
     main()
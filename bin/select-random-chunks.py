@@ -2,7 +2,8 @@
 # coding=utf-8
 
 # @file select-random-chunks.py
-# @brief Select a number of random chunks of a specified size producing an index file.
+# @brief Select a number of random chunks of a specified size producing an index file,
+# or writing the selected chunks of the input files directly.
 #
 # @author Darlene Stewart
 #
@@ -18,9 +19,12 @@ import sys
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 import os
 import os.path
-import subprocess
+import heapq
+import math
 import random
 
+from itertools import compress
+
 from portage_utils import *
 
 
@@ -34,6 +38,21 @@ def get_args():
    The generated indicies are 1-based.
 
    outfile can be used as an indexfile for select-lines.py.
+
+   With -w, write the selected chunks of infile, and of any line-aligned
+   parallel files, directly instead, in a single pass: with -m or -f, or when
+   infile has a line index (see build-line-index.py), the same chunks are
+   selected as for the index file; otherwise, e.g., for pipes and .gz files,
+   the chunks are selected by reservoir sampling as infile is read, which is
+   reproducible for a given seed too, but selects different chunks.
+
+   With --strata and/or --weights, the sample is stratified and/or weighted,
+   using the labels and weights of the first line and of all the lines of
+   each chunk, respectively. Only the files given are read, so an index file
+   can be produced without reading the corpus itself. Chunks are sampled
+   without replacement with Efraimidis-Spirakis keys, log(u) / weight for
+   uniform u, keeping the chunks with the largest keys in each stratum, so
+   only the sample is held in memory.
    """
 
 #    parser = ArgumentParser(usage=usage, description=help, add_help=False,
@@ -53,7 +72,7 @@ def get_args():
    group1.add_argument("-o", "--outsize", dest="output_size", type=int,
                        help="Target size for outfile [num_chunks * chunk_size]")
 
-   group2 = parser.add_mutually_exclusive_group(required=True)
+   group2 = parser.add_mutually_exclusive_group(required=False)
    group2.add_argument("-m", "--max-index", dest="max_index", type=int,
                        help="Number of chunks to select [%(default)s]")
    group2.add_argument("-f", "--infile", dest="infile", type=str,
@@ -62,19 +81,224 @@ def get_args():
    parser.add_argument("-s", "--seed", dest="seed", default=2020, type=int,
                        help="Seed for random number generator. [%(default)s]")
 
+   parser.add_argument("-w", "--write", dest="write", nargs=2, action="append", default=[],
+                       metavar=("INFILE", "OUTFILE"),
+                       help="Write the selected chunks of INFILE to OUTFILE, instead of "
+                            "producing an index file; repeat for line-aligned parallel "
+                            "files. [none]")
+   parser.add_argument("--strata", dest="strata", type=str, metavar="LABELFILE",
+                       help="Stratify the sample on the labels in LABELFILE, e.g., domains or "
+                            "document ids, one per line, line-aligned with the input: each "
+                            "label gets its proportional share of the chunks, or with "
+                            "--weights, of the chunks with a positive weight. LABELFILE is "
+                            "read twice, so it cannot be a pipe. [none]")
+   parser.add_argument("--weights", dest="weights", type=str, metavar="WEIGHTFILE",
+                       help="Weight the sample by the non-negative weights in WEIGHTFILE, "
+                            "one per line, line-aligned with the input; a chunk's weight "
+                            "is the sum of its lines' weights. With --strata, WEIGHTFILE "
+                            "is read twice too, so it cannot be a pipe. [none]")
+
    parser.add_argument("outfile", nargs='?', type=lambda f: open(f,'w'), default=sys.stdout,
                        help="output file [sys.stdout]")
 
    cmd_args = parser.parse_args()
 
+   if cmd_args.write and cmd_args.outfile is not sys.stdout:
+      fatal_error("outfile cannot be used with -w")
+   if cmd_args.strata or cmd_args.weights:
+      if cmd_args.max_index is not None or cmd_args.infile is not None:
+         fatal_error("-m/--max-index and -f/--infile cannot be used with --strata or --weights")
+      if cmd_args.strata == "-" or cmd_args.strata and cmd_args.strata.endswith("|"):
+         fatal_error("--strata LABELFILE is read twice, so it cannot be stdin or a pipe")
+      if cmd_args.strata and (cmd_args.weights == "-" or
+                              cmd_args.weights and cmd_args.weights.endswith("|")):
+         fatal_error("With --strata, --weights WEIGHTFILE is read twice, so it cannot be "
+                     "stdin or a pipe")
+   elif not cmd_args.write and cmd_args.max_index is None and cmd_args.infile is None:
+      fatal_error("one of -m/--max-index or -f/--infile is required without -w")
+
    return cmd_args
 
 
 def file_size( filename ):
-   result = subprocess.run(['wc', '-l', filename], stdout=subprocess.PIPE)
-   if result.returncode != 0:
-      fatal_error("Cannot access (using wc -l):", filename)
-   return int(result.stdout.decode().split()[0])
+   """Return the number of lines in filename, from its line index if it has
+   one, otherwise by counting newlines, like wc -l, also in compressed files.
+   """
+   line_index = load_line_index(filename)
+   if line_index is not None:
+      return line_index.num_lines
+   try:
+      with open(filename, 'rb') as f:
+         return sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b""))
+   except IOError as e:
+      fatal_error("Cannot access:", filename, e)
+
+
+def write_known_chunks(chunks, chunk_size, infiles, outfiles, progress):
+   """Write the chunks starting at the sorted 1-based line numbers in chunks
+   from infiles to outfiles, stopping after the last chunk.
+   """
+   batch_size = chunk_size * max(1, 10000 // chunk_size)    # chunks never straddle batches
+   next_chunk = 0
+   with ParallelReader(infiles, batch_size=batch_size, progress=progress) as reader, \
+        ParallelWriter(outfiles) as writer:
+      for columns in reader.batches():
+         if next_chunk == len(chunks):
+            break
+         first = reader.line_count - len(columns[0]) + 1
+         keep = [False] * len(columns[0])
+         while next_chunk < len(chunks) and chunks[next_chunk] < first + len(keep):
+            start = chunks[next_chunk] - first
+            keep[start:start + chunk_size] = [True] * chunk_size
+            next_chunk += 1
+         writer.write_columns([compress(column, keep) for column in columns])
+   if next_chunk < len(chunks) or reader.line_count < chunks[-1] + chunk_size - 1:
+      fatal_error(infiles[0], "has fewer lines than max_index.")
+
+
+def write_reservoir_chunks(num_chunks, chunk_size, infiles, outfiles, progress):
+   """Select num_chunks random chunks of infiles by reservoir sampling, in a
+   single pass, and write them to outfiles.
+
+   Uses Li's Algorithm L, which draws how many chunks to skip between
+   replacements, so the random number generator is only called O(k log(n/k))
+   times. Only the complete chunks of chunk_size lines starting at lines
+   1, 1+chunk_size, 1+2*chunk_size, ... are candidates, as without -w.
+   """
+   k = num_chunks
+   reservoir = []                   # (chunk number, chunk columns)
+   next_pick = 0                    # number of the next chunk to put in the reservoir
+   w = 1.0
+   chunk_count = 0
+   batch_size = chunk_size * max(1, 10000 // chunk_size)
+   with ParallelReader(infiles, batch_size=batch_size, progress=progress) as reader:
+      for columns in reader.batches():
+         batch_chunks = len(columns[0]) // chunk_size
+         while k and next_pick < chunk_count + batch_chunks:
+            start = (next_pick - chunk_count) * chunk_size
+            chunk = (next_pick, [column[start:start + chunk_size] for column in columns])
+            if len(reservoir) < k:
+               reservoir.append(chunk)
+               if len(reservoir) < k:
+                  next_pick += 1
+                  continue
+            else:
+               reservoir[random.randrange(k)] = chunk
+            w *= math.exp(math.log(1.0 - random.random()) / k)
+            next_pick += int(math.log(1.0 - random.random()) / math.log1p(-w)) + 1
+         chunk_count += batch_chunks
+   if chunk_count < k:
+      fatal_error("num_chunks (", k, ") must be <= the number of chunks in", infiles[0],
+                  "(", chunk_count, ").")
+   with ParallelWriter(outfiles) as writer:
+      for _, chunk in sorted(reservoir, key=lambda number_chunk: number_chunk[0]):
+         writer.write_columns(chunk)
+
+
+def chunk_weight(weights, weight_file, first_line):
+   """Return the weight of a chunk, the sum of weights, the lines of
+   weight_file from line first_line on, and make it a fatal error for a weight
+   not to be a number, or for the sum to be negative.
+   """
+   try:
+      weight = sum(map(float, weights))
+   except ValueError:
+      for line_number, line in enumerate(weights, first_line):
+         try:
+            float(line)
+         except ValueError:
+            fatal_error("Invalid weight in", weight_file, "at line", str(line_number) + ":",
+                        line.strip())
+   if weight < 0:
+      fatal_error("Negative weight in", weight_file, "at line", first_line)
+   return weight
+
+
+def stratum_allocation(label_file, weight_file, num_chunks, chunk_size):
+   """Return a dict giving the number of chunks to select with each label in
+   label_file, proportionally to the number of chunks with that label, by the
+   largest remainder method.
+
+   Only complete chunks, starting at lines 1, 1+chunk_size, ..., count; a
+   chunk's label is that of its first line.  With weight_file, only the
+   chunks with a positive weight count, so that no label is allocated more
+   chunks than it can provide.
+   """
+   counts = {}
+   files = [label_file, weight_file] if weight_file else [label_file]
+   batch_size = chunk_size * max(1, 10000 // chunk_size)
+   with ParallelReader(files, batch_size=batch_size) as reader:
+      for columns in reader.batches():
+         first_line = reader.line_count - len(columns[0]) + 1
+         for start in range(0, len(columns[0]) - chunk_size + 1, chunk_size):
+            if weight_file and chunk_weight(columns[1][start:start + chunk_size], weight_file,
+                                            first_line + start) <= 0:
+               continue
+            label = columns[0][start].rstrip("\n")
+            counts[label] = counts.get(label, 0) + 1
+   total = sum(counts.values())
+   if num_chunks > total:
+      fatal_error("num_chunks (", num_chunks, ") must be <= the number of chunks",
+                  "with a positive weight" if weight_file else "in " + label_file,
+                  "(", total, ").")
+   quotas = {label: num_chunks * count / total for label, count in counts.items()} if total else {}
+   allocation = {label: int(quota) for label, quota in quotas.items()}
+   # Dicts keep labels in order of first appearance, which breaks ties deterministically.
+   by_remainder = sorted(quotas, key=lambda label: quotas[label] - allocation[label], reverse=True)
+   for label in by_remainder[:num_chunks - sum(allocation.values())]:
+      allocation[label] += 1
+   return allocation
+
+
+def sample_chunks(num_chunks, chunk_size, label_file, weight_file, infiles, progress):
+   """Select chunks by stratified and/or weighted sampling without replacement.
+
+   Each complete chunk gets an Efraimidis-Spirakis key, log(u) / weight for
+   uniform u, and the chunks with the largest keys are kept in a min-heap per
+   label, sized by stratum_allocation(), or a single heap of num_chunks
+   without label_file.
+
+   return: the (chunk number, chunk columns of infiles) of the selected
+      chunks, in increasing order of chunk number.
+   """
+   allocation = stratum_allocation(label_file, weight_file, num_chunks, chunk_size) \
+                if label_file else None
+   if allocation is not None:
+      verbose("allocation:", " ".join("%s:%d" % item for item in allocation.items()))
+   heaps = {}
+   chunk_count = 0
+   positive_count = 0
+   files = [name for name in (label_file, weight_file) if name] + infiles
+   first_infile = len(files) - len(infiles)
+   batch_size = chunk_size * max(1, 10000 // chunk_size)
+   with ParallelReader(files, batch_size=batch_size, progress=progress) as reader:
+      for columns in reader.batches():
+         labels = columns[0] if label_file else None
+         weights = columns[first_infile - 1] if weight_file else None
+         for start in range(0, len(columns[0]) - chunk_size + 1, chunk_size):
+            u = 1.0 - random.random()
+            weight = 1.0
+            if weights is not None:
+               weight = chunk_weight(weights[start:start + chunk_size], weight_file,
+                                     reader.line_count - len(columns[0]) + start + 1)
+            if weight > 0:
+               positive_count += 1
+               label = labels[start].rstrip("\n") if labels is not None else None
+               size = allocation[label] if allocation is not None else num_chunks
+               heap = heaps.setdefault(label, [])
+               key = math.log(u) / weight
+               if len(heap) < size or size and key > heap[0][0]:
+                  entry = (key, chunk_count,
+                           [column[start:start + chunk_size] for column in columns[first_infile:]])
+                  if len(heap) < size:
+                     heapq.heappush(heap, entry)
+                  else:
+                     heapq.heapreplace(heap, entry)
+            chunk_count += 1
+   if allocation is None and positive_count < num_chunks:
+      fatal_error("num_chunks (", num_chunks, ") must be <= the number of chunks",
+                  "with a positive weight (", positive_count, ").")
+   return sorted((number, chunk) for heap in heaps.values() for key, number, chunk in heap)
 
 
 def main():
@@ -91,10 +315,17 @@ def main():
    else:
       num_chunks = cmd_args.num_chunks
 
+   infiles = [infile for infile, outfile in cmd_args.write]
+   outfiles = [outfile for infile, outfile in cmd_args.write]
    if cmd_args.infile is not None:
       max_index = file_size(cmd_args.infile)
-   else:
+   elif cmd_args.max_index is not None:
       max_index = cmd_args.max_index
+   elif cmd_args.strata or cmd_args.weights:
+      max_index = None
+   else:
+      line_index = load_line_index(infiles[0]) if infiles[0] != "-" else None
+      max_index = line_index.num_lines if line_index is not None else None
 
    verbose("seed:", cmd_args.seed)
    verbose("chunk_size:", cmd_args.chunk_size)
@@ -103,8 +334,43 @@ def main():
    verbose("num_chunks:", num_chunks)
    if cmd_args.infile is not None:
       verbose("infile:", cmd_args.infile)
-   verbose("max_index: ", max_index)
-   verbose("outfile: ", cmd_args.outfile)
+   if cmd_args.strata:
+      verbose("strata: ", cmd_args.strata)
+   if cmd_args.weights:
+      verbose("weights: ", cmd_args.weights)
+   verbose("max_index: ", "unknown: reservoir sampling" if max_index is None else max_index)
+   if cmd_args.write:
+      verbose("write: ", " ".join(infile + " > " + outfile for infile, outfile in cmd_args.write))
+   else:
+      verbose("outfile: ", cmd_args.outfile)
+
+   if cmd_args.strata or cmd_args.weights:
+      progress = Progress("select-random-chunks.py", total_bytes=Progress.input_size(
+         *[name for name in (cmd_args.strata, cmd_args.weights) if name] + infiles))
+      try:
+         chunks = sample_chunks(num_chunks, cmd_args.chunk_size, cmd_args.strata, cmd_args.weights,
+                                infiles, progress)
+      except ParallelLengthError as e:
+         fatal_error(e)
+      progress.done()
+      if cmd_args.write:
+         with ParallelWriter(outfiles) as writer:
+            for number, chunk in chunks:
+               writer.write_columns(chunk)
+      else:
+         for number, chunk in chunks:
+            for i in range(cmd_args.chunk_size):
+               print(number * cmd_args.chunk_size + i + 1, file=cmd_args.outfile)
+         cmd_args.outfile.close()
+      return
+
+   if max_index is None:
+      try:
+         write_reservoir_chunks(num_chunks, cmd_args.chunk_size, infiles, outfiles,
+                                Progress("select-random-chunks.py", total_bytes=Progress.input_size(*infiles)))
+      except ParallelLengthError as e:
+         fatal_error(e)
+      return
 
    if num_chunks * cmd_args.chunk_size > max_index:
       fatal_error("num_chunks * chunk_size (", num_chunks * cmd_args.chunk_size,
@@ -113,9 +379,23 @@ def main():
    max_range = max_index - (cmd_args.chunk_size-1) + 1
    chunks = sorted(random.sample(range(1, max_range, cmd_args.chunk_size), num_chunks))
 
+   if cmd_args.write:
+      if chunks:
+         try:
+            write_known_chunks(chunks, cmd_args.chunk_size, infiles, outfiles,
+                               Progress("select-random-chunks.py", total_lines=chunks[-1] + cmd_args.chunk_size - 1))
+         except ParallelLengthError as e:
+            fatal_error(e)
+      else:
+         ParallelWriter(outfiles).close()
+      return
+
+   progress = Progress("select-random-chunks.py", total_lines=num_chunks * cmd_args.chunk_size)
    for index in chunks:
       for i in range(cmd_args.chunk_size):
          print(index+i, file=cmd_args.outfile)
+      progress.update(cmd_args.chunk_size)
+   progress.done()
 
    cmd_args.outfile.close()
 
@@ -12,18 +12,445 @@
 # Copyright 2012, Sa Majeste la Reine du Chef du Canada /
 # Copyright 2012, Her Majesty in Right of Canada
 
+import heapq
+import os
+import re
+import zlib
 from argparse import ArgumentParser, FileType
+from array import array
+from hashlib import blake2b
+from itertools import compress, islice
 
 from portage_utils import (
-    open,
     fatal_error,
     printCopyright,
     DebugAction,
     HelpAction,
     VerboseAction,
+    Progress,
+    ParallelReader,
+    ParallelWriter,
+    ParallelLengthError,
 )
 
 
+class HashSet(object):
+   """Set of non-zero 64- or 128-bit hashes in an open-addressing table.
+
+   The table is an array('Q'), i.e., 8 bytes per word, kept at most 3/4 full
+   with linear probing, so each hash costs 11 to 21 bytes (64 bits) or 21 to
+   43 bytes (128 bits), instead of about 60 bytes for a Python int in a set
+   and much more for the lines themselves.
+
+   bits: 64 or 128
+   """
+   def __init__(self, bits=64, capacity=1 << 16):
+      self.words = bits // 64
+      self.count = 0
+      self._allocate(capacity)
+
+   def _allocate(self, capacity):
+      self.slots = array('Q', [0]) * (capacity * self.words)
+      self.mask = capacity - 1
+      self.limit = capacity * 3 // 4
+
+   def add_all(self, keys):
+      """Add keys, returning a list of booleans, True for keys that were not
+      already in the set, including earlier in keys.
+      """
+      if self.words == 1:
+         new = self._add_all_64(keys)
+      else:
+         new = self._add_all_128(keys)
+      return new
+
+   def _add_all_64(self, keys):
+      slots, mask = self.slots, self.mask
+      new = []
+      append = new.append
+      for key in keys:
+         i = key & mask
+         slot = slots[i]
+         while slot and slot != key:
+            i = (i + 1) & mask
+            slot = slots[i]
+         if slot:
+            append(False)
+         else:
+            slots[i] = key
+            append(True)
+            self.count += 1
+            if self.count > self.limit:
+               self._grow()
+               slots, mask = self.slots, self.mask
+      return new
+
+   def _add_all_128(self, keys):
+      slots, mask = self.slots, self.mask
+      new = []
+      append = new.append
+      for key in keys:
+         low, high = key & 0xFFFFFFFFFFFFFFFF, key >> 64
+         i = low & mask
+         while (slots[2*i] or slots[2*i+1]) and (slots[2*i] != low or slots[2*i+1] != high):
+            i = (i + 1) & mask
+         if slots[2*i] or slots[2*i+1]:
+            append(False)
+         else:
+            slots[2*i], slots[2*i+1] = low, high
+            append(True)
+            self.count += 1
+            if self.count > self.limit:
+               self._grow()
+               slots, mask = self.slots, self.mask
+      return new
+
+   def _grow(self):
+      old, words = self.slots, self.words
+      self.count = 0
+      self._allocate((self.mask + 1) * 2)
+      if words == 1:
+         self._add_all_64(key for key in old if key)
+      else:
+         self._add_all_128(old[2*i] | old[2*i+1] << 64 for i in range(len(old) // 2)
+                           if old[2*i] or old[2*i+1])
+
+def row_hashes(columns, bits=64):
+   """Return the blake2b hashes, as non-zero ints, of the rows of lines in columns."""
+   size = bits // 8
+   from_bytes = int.from_bytes
+   # Lines end with a newline, so concatenating a row's lines is unambiguous.
+   return [from_bytes(blake2b(row, digest_size=size).digest(), "little") or 1
+           for row in map(str.encode, map("".join, zip(*columns)))]
+
+def splitmix64(seed):
+   """Yield a deterministic sequence of well-mixed 64-bit integers from seed."""
+   while True:
+      seed = (seed + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+      z = seed
+      z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+      z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+      yield z ^ (z >> 31)
+
+class NearDuplicateFilter(object):
+   """Find near-duplicate rows with MinHash signatures and LSH banding.
+
+   Each row, i.e., the compared lines of one line number, is turned into the
+   set of its shingles: its character or word n-grams. A MinHash signature
+   of permutations values estimates the Jaccard similarity of two shingle
+   sets, as the fraction of their values that are equal. It is cut into bands
+   of rows_per_band values, chosen so that two rows with a similarity >=
+   threshold are likely to agree on at least one whole band. The rows that
+   share a band with a row are its candidates, and the row is a
+   near-duplicate if its estimated similarity with one of them is >=
+   threshold.
+
+   Only the rows kept, i.e., not near-duplicates, are candidates: their
+   signatures are kept in an array, and a dict maps a 64-bit hash of each
+   of their bands to them, so near-duplicates don't chain: if A is kept and
+   B is a near-duplicate of A, C is only stripped if it is similar enough to
+   A itself.
+
+   Signatures are computed with NumPy, a batch of rows at a time.
+
+   np: the numpy module
+   threshold: Jaccard similarity above which rows are near-duplicates
+   shingle: n-gram size
+   words: use word n-grams instead of character n-grams
+   permutations: number of MinHash values per signature
+   normalize: optional function applied to each row before shingling
+   """
+   mix = (0xBF58476D1CE4E5B9, 0x94D049BB133111EB)
+
+   def __init__(self, np, threshold, shingle=5, words=False, permutations=64, normalize=None):
+      self.np = np
+      self.threshold = threshold
+      self.shingle = shingle
+      self.words = words
+      self.normalize = normalize
+      # The band structure whose S-curve threshold, (1/bands)**(1/rows_per_band), is closest.
+      self.rows_per_band, self.bands = min(
+         ((r, permutations // r) for r in range(1, permutations + 1)),
+         key=lambda rb: abs((1.0 / rb[1]) ** (1.0 / rb[0]) - threshold))
+      randoms = splitmix64(0x5EED)
+      self.a = np.array([next(randoms) | 1 for _ in range(self.rows_per_band * self.bands)],
+                        dtype=np.uint64)
+      self.b = np.array([next(randoms) for _ in range(self.rows_per_band * self.bands)],
+                        dtype=np.uint64)
+      self.band_salts = np.array([next(randoms) for _ in range(self.bands)], dtype=np.uint64)
+      # Signatures of the rows kept, and the rows kept with each band hash,
+      # as an int, or a list of them for the rare bands shared by several.
+      self.kept = np.empty((1024, self.rows_per_band * self.bands), dtype=np.uint64)
+      self.kept_count = 0
+      self.rows_of_band = {}
+
+   def _mix(self, h):
+      """Finalize 64-bit hashes h in place, splitmix64 style."""
+      np = self.np
+      h ^= h >> np.uint64(30)
+      h *= np.uint64(self.mix[0])
+      h ^= h >> np.uint64(27)
+      h *= np.uint64(self.mix[1])
+      h ^= h >> np.uint64(31)
+      return h
+
+   def _units(self, rows):
+      """Return the units of rows, characters or hashed words, as one uint64
+      array, and the number of units in each row.
+      """
+      np = self.np
+      if self.words:
+         tokens = [row.split() for row in rows]
+         units = np.array([zlib.crc32(token.encode("utf-8")) for row in tokens for token in row],
+                          dtype=np.uint64)
+         return units, np.array([len(row) for row in tokens], dtype=np.int64)
+      units = np.frombuffer("".join(rows).encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+      return units.astype(np.uint64), np.array([len(row) for row in rows], dtype=np.int64)
+
+   def signatures(self, rows):
+      """Return the MinHash signatures of rows, as an array of shape
+      (len(rows), bands * rows_per_band).
+      """
+      np = self.np
+      k = self.shingle
+      units, lengths = self._units(rows)
+      signatures = np.full((len(rows), len(self.a)), np.iinfo(np.uint64).max, dtype=np.uint64)
+      nonempty = np.flatnonzero(lengths)
+      if len(nonempty) == 0:
+         return signatures
+
+      # Precede each row with k-1 padding units, so that the n-gram ending at
+      # each unit is defined, and even rows shorter than k have one n-gram.
+      row_of_unit = np.repeat(np.arange(len(rows)), lengths)
+      positions = np.arange(len(units)) + (row_of_unit + 1) * (k - 1)
+      padded = np.zeros(len(units) + len(rows) * (k - 1), dtype=np.uint64)
+      padded[positions] = units + np.uint64(1)
+      shingles = np.zeros(len(units), dtype=np.uint64)
+      for j in range(k):
+         shingles *= np.uint64(0x100000001B3)
+         shingles += padded[positions - (k - 1 - j)]
+      self._mix(shingles)
+
+      starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))[nonempty]
+      values = np.empty_like(shingles)
+      for i in range(len(self.a)):
+         np.multiply(shingles, self.a[i], out=values)
+         values += self.b[i]
+         signatures[nonempty, i] = np.minimum.reduceat(values, starts)
+      return signatures
+
+   def __call__(self, columns):
+      """Return a list of booleans, True for the rows of columns that are not
+      near-duplicates of earlier rows, including earlier rows in columns.
+      """
+      np = self.np
+      if self.normalize is None:
+         rows = ["".join(lines) for lines in zip(*columns)]
+      else:
+         rows = ["\n".join(map(self.normalize, lines)) for lines in zip(*columns)]
+      signatures = self.signatures(rows)
+      r = self.rows_per_band
+      band_keys = np.zeros((len(rows), self.bands), dtype=np.uint64)
+      for band in range(self.bands):
+         key = band_keys[:, band]
+         for j in range(band * r, (band + 1) * r):
+            key *= np.uint64(0x100000001B3)
+            key ^= signatures[:, j]
+         key ^= self.band_salts[band]
+      self._mix(band_keys)
+
+      keep = []
+      rows_of_band = self.rows_of_band
+      for signature, keys in zip(signatures, band_keys.tolist()):
+         candidates = set()
+         for key in keys:
+            rows = rows_of_band.get(key)
+            if rows is not None:
+               if isinstance(rows, int):
+                  candidates.add(rows)
+               else:
+                  candidates.update(rows)
+         if candidates:
+            similarities = (self.kept[list(candidates)] == signature).mean(axis=1)
+            if similarities.max() >= self.threshold:
+               keep.append(False)
+               continue
+         keep.append(True)
+         row = self._keep(signature)
+         for key in keys:
+            rows = rows_of_band.setdefault(key, row)
+            if rows != row:
+               if isinstance(rows, int):
+                  rows_of_band[key] = [rows, row]
+               else:
+                  rows.append(row)
+      return keep
+
+   def _keep(self, signature):
+      """Add signature to the signatures of the rows kept, and return its row number."""
+      if self.kept_count == len(self.kept):
+         self.kept = self.np.concatenate((self.kept, self.np.empty_like(self.kept)))
+      self.kept[self.kept_count] = signature
+      self.kept_count += 1
+      return self.kept_count - 1
+
+def normalizer():
+   """Return a function that normalizes text for near-duplicate detection:
+   clean_utf8.py cleaning with NFKC normalization, case folding, all digits
+   mapped to 0, punctuation removed and whitespace collapsed.
+   """
+   from clean_utf8 import CleanUTF8
+
+   cleaner = CleanUTF8(normalization_type="NFKC")
+   re_digit = re.compile(r"\d")
+   re_punct = re.compile(r"[^\w\s]|_")
+
+   def normalize(text):
+      text = re_digit.sub("0", cleaner.clean_line(text).casefold())
+      return " ".join(re_punct.sub(" ", text).split())
+
+   return normalize
+
+BUCKET_BITS = 8             # hash bits used to partition the hashes at each level, with -M
+BLOCK_SIZE = 1 << 16        # words read from bucket files at a time
+
+def bucket_entry_size(words):
+   """Return the approximate number of bytes needed per entry to dedup a
+   bucket in memory: the entries themselves, the HashSet, the keep mask
+   and the line numbers kept.
+   """
+   return 8 * (3 * words + 3)
+
+def read_words(filename):
+   """Yield the 64-bit words in filename, reading them one block at a time."""
+   with open(filename, "rb") as f:
+      while True:
+         block = array('Q')
+         try:
+            block.fromfile(f, BLOCK_SIZE)
+         except EOFError:
+            # fromfile() raises EOFError on a partial block, but keeps it
+            pass
+         if not block:
+            break
+         for word in block:
+            yield word
+
+def split_bucket(filename, words, shift):
+   """Split the (hash, line number) entries in filename into 2**BUCKET_BITS
+   files by the hash bits at shift, and return their filenames.
+   """
+   stride = words + 1
+   filenames = ["{0}.{1:02x}".format(filename, i) for i in range(1 << BUCKET_BITS)]
+   files = [open(name, "wb") for name in filenames]
+   try:
+      with open(filename, "rb") as f:
+         while True:
+            block = array('Q')
+            try:
+               block.fromfile(f, BLOCK_SIZE * stride)
+            except EOFError:
+               pass
+            if not block:
+               break
+            buckets = [array('Q') for _ in files]
+            for i in range(0, len(block), stride):
+               key = block[i] if words == 1 else block[i] | block[i+1] << 64
+               buckets[(key >> shift) & ((1 << BUCKET_BITS) - 1)].extend(block[i:i+stride])
+            for bucket, f_out in zip(buckets, files):
+               if bucket:
+                  bucket.tofile(f_out)
+   finally:
+      for f_out in files:
+         f_out.close()
+   os.remove(filename)
+   return filenames
+
+def dedup_bucket(task):
+   """Dedup the (hash, line number) entries of one bucket file, in line order.
+
+   If the bucket holds more than max_entries entries, it is split further on
+   the next BUCKET_BITS hash bits first.
+
+   task: (filename, words, shift, max_entries), where words is the number of
+      64-bit words per hash and shift the position of the hash bits that
+      defined this bucket
+   return: the name of the file holding the line numbers kept, in increasing order
+   """
+   filename, words, shift, max_entries = task
+   stride = words + 1
+   entries = os.path.getsize(filename) // (8 * stride)
+   if entries > max_entries and shift >= BUCKET_BITS:
+      kept_files = [dedup_bucket((name, words, shift - BUCKET_BITS, max_entries))
+                    for name in split_bucket(filename, words, shift - BUCKET_BITS)]
+      # Merge the sub-buckets right away, to keep few files open at a time.
+      with open(filename + ".kept", "wb") as f:
+         merged = heapq.merge(*(read_words(name) for name in kept_files))
+         while True:
+            block = array('Q', islice(merged, BLOCK_SIZE))
+            if not block:
+               break
+            block.tofile(f)
+      for name in kept_files:
+         os.remove(name)
+      return filename + ".kept"
+
+   data = array('Q')
+   with open(filename, "rb") as f:
+      data.fromfile(f, entries * stride)
+   os.remove(filename)
+   if words == 1:
+      keys = data[0::stride]
+   else:
+      keys = (low | high << 64 for low, high in zip(data[0::stride], data[1::stride]))
+   seen = HashSet(64 * words, capacity=1 << max(16, (entries * 4 // 3).bit_length()))
+   kept = array('Q', compress(data[words::stride], seen.add_all(keys)))
+   del data, seen
+   with open(filename + ".kept", "wb") as f:
+      kept.tofile(f)
+   return filename + ".kept"
+
+def external_dedup(in_files, compare, bits, memory, jobs, tmp_dir, progress):
+   """Return an iterator over the 0-based numbers of the lines to keep, in
+   increasing order, when deduplicating the first compare files of in_files
+   globally without holding all the hashes in memory.
+
+   The (hash, line number) pairs are spilled to 2**BUCKET_BITS bucket files
+   by hash prefix, each bucket is deduped independently, in a pool of jobs
+   processes, and the line numbers kept in all buckets are merged back.
+   """
+   words = bits // 64
+   filenames = [os.path.join(tmp_dir, "bucket.{0:02x}".format(i)) for i in range(1 << BUCKET_BITS)]
+   files = [open(name, "wb") for name in filenames]
+   shift = bits - BUCKET_BITS
+   try:
+      with ParallelReader(in_files[:compare], progress=progress) as reader:
+         for columns in reader.batches():
+            buckets = [array('Q') for _ in files]
+            line_number = reader.line_count - len(columns[0])
+            for key in row_hashes(columns, bits):
+               if words == 1:
+                  buckets[key >> shift].extend((key, line_number))
+               else:
+                  buckets[key >> shift].extend((key & 0xFFFFFFFFFFFFFFFF, key >> 64, line_number))
+               line_number += 1
+            for bucket, f in zip(buckets, files):
+               if bucket:
+                  bucket.tofile(f)
+   finally:
+      for f in files:
+         f.close()
+
+   max_entries = max(1, memory // jobs // bucket_entry_size(words))
+   tasks = [(name, words, shift, max_entries) for name in filenames if os.path.getsize(name)]
+   if jobs > 1:
+      import multiprocessing
+      with multiprocessing.Pool(jobs) as pool:
+         kept_files = pool.map(dedup_bucket, tasks, chunksize=1)
+   else:
+      kept_files = [dedup_bucket(task) for task in tasks]
+   return heapq.merge(*(read_words(name) for name in kept_files))
+
 def get_args():
    """Command line argument processing."""
 
@@ -35,6 +462,14 @@ def get_args():
    If <fileN> and subsequent files are provided, where N is > the number of
    files to compare, they are stripped in parallel, but don't participate in
    the identical line comparison.
+   With -g, strip lines whose compared lines, taken together, already
+   occurred on an earlier line instead, anywhere in the files, like
+   parallel-uniq.pl does, keeping first occurrences in their original order.
+   Only a hash of each distinct line pair is kept in memory; with -M, the
+   hashes are spilled to temporary files in $TMPDIR, for corpora whose
+   hashes don't fit in memory.
+   With -near, also strip near-duplicates of earlier lines, found with MinHash
+   and LSH: this needs NumPy.
    """
 
    # Use the argparse module, not the deprecated optparse module.
@@ -49,43 +484,121 @@ def get_args():
                        help="number of files to compare [%(default)s]")
    parser.add_argument("-ext", dest="ext", type=str, default=".dedup",
                        help="extension for output files [%(default)s]")
+   parser.add_argument("-g", "--global", dest="global_dedup", action="store_true",
+                       help="strip duplicates of earlier lines across the whole files; "
+                            "-c can then be 1 [%(default)s]")
+   parser.add_argument("-bits", dest="bits", type=int, choices=(64, 128), default=64,
+                       help="size of the hashes stored with -g; with 64 bits, each distinct "
+                            "line pair takes 11 to 21 bytes, and 500M of them have a ~1%% "
+                            "chance of one false duplicate [%(default)s]")
+   parser.add_argument("-M", dest="memory", type=int, default=None, metavar="MB",
+                       help="with -g, use about MB megabytes of memory at most, spilling the "
+                            "hashes to disk; the files must then be regular files "
+                            "[keep all hashes in memory]")
+   parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=None,
+                       help="with -M, dedup the spilled hashes using this many processes [1]")
+
+   near = parser.add_argument_group("Near-duplicate options")
+   near.add_argument("-near", dest="near", type=float, default=None, metavar="T",
+                     help="strip lines whose compared lines, taken together, have an "
+                          "estimated Jaccard similarity >= T with an earlier line, "
+                          "e.g., 0.8; -c can then be 1 [exact duplicates only]")
+   near.add_argument("-shingle", dest="shingle", type=int, default=5, metavar="N",
+                     help="with -near, compare character N-grams [%(default)s]")
+   near.add_argument("-words", dest="words", action="store_true",
+                     help="with -near, compare word N-grams instead [%(default)s]")
+   near.add_argument("-perm", dest="permutations", type=int, default=64, metavar="P",
+                     help="with -near, number of MinHash permutations: more is more "
+                          "precise, but slower and bigger [%(default)s]")
+   near.add_argument("-normalize", dest="normalize", action="store_true",
+                     help="with -near, normalize lines first: clean them like "
+                          "clean_utf8.py, apply NFKC, fold case, map digits to 0, "
+                          "and strip punctuation and extra whitespace [%(default)s]")
 
    parser.add_argument("in_files", nargs="*", type=FileType('r', encoding="utf-8"),
                        help="files to strip lines from in parallel")
 
    cmd_args = parser.parse_args()
-   if cmd_args.compare < 2:
-      fatal_error("Number of files to compare (-c) must be >= 2: ", cmd_args.compare)
+   if cmd_args.near is not None:
+      if cmd_args.global_dedup:
+         fatal_error("-near and -g cannot be combined; -near already strips exact duplicates")
+      if not 0 < cmd_args.near <= 1:
+         fatal_error("-near threshold must be in (0, 1]: ", cmd_args.near)
+      if cmd_args.shingle < 1 or cmd_args.permutations < 1:
+         fatal_error("-shingle and -perm must be >= 1")
+   if cmd_args.compare < (1 if cmd_args.global_dedup or cmd_args.near is not None else 2):
+      fatal_error("Number of files to compare (-c) must be >= 2, or >= 1 with -g or -near: ",
+                  cmd_args.compare)
    if len(cmd_args.in_files) < cmd_args.compare:
       fatal_error(cmd_args.compare, "files required for comparison.")
+   if cmd_args.jobs is not None and cmd_args.memory is None:
+      fatal_error("-j can only be used with -M")
+   if cmd_args.memory is not None:
+      if not cmd_args.global_dedup:
+         fatal_error("-M can only be used with -g")
+      if cmd_args.jobs is None:
+         cmd_args.jobs = 1
+      if cmd_args.memory < 1 or cmd_args.jobs < 1:
+         fatal_error("-M and -j must be >= 1")
+      for f in cmd_args.in_files[:cmd_args.compare]:
+         if not f.seekable():
+            fatal_error("-M reads the files twice, so", f.name, "must be a regular file")
 
    return cmd_args
 
+def near_duplicate_filter(cmd_args):
+   """Return the NearDuplicateFilter for the -near options in cmd_args."""
+   try:
+      import numpy
+   except ImportError:
+      fatal_error("-near requires NumPy: pip3 install numpy")
+   return NearDuplicateFilter(numpy, cmd_args.near, cmd_args.shingle, cmd_args.words,
+                              cmd_args.permutations, normalizer() if cmd_args.normalize else None)
+
 def main():
    printCopyright("strip-parallel-duplicates.py", 2012)
 
    cmd_args = get_args()
-   out_files = tuple(open(f.name+cmd_args.ext, 'w', encoding="utf8") for f in cmd_args.in_files)
+   compare = cmd_args.compare
+   progress = Progress("strip-parallel-duplicates.py",
+                       total_bytes=Progress.input_size(*(f.name for f in cmd_args.in_files)))
 
-   eof = False
-   while True:
-      lines = []
-      for f in cmd_args.in_files:
-         lines.append(f.readline())
-         if len(lines[-1]) == 0: eof = True
-      if eof: break
-      for i in range(1, cmd_args.compare):
-         if lines[i] != lines[0]: identical = False; break
+   try:
+      if cmd_args.memory is not None:
+         import tempfile
+         with tempfile.TemporaryDirectory(prefix="strip-parallel-duplicates.py.") as tmp_dir:
+            kept = external_dedup(cmd_args.in_files, compare, cmd_args.bits,
+                                  cmd_args.memory << 20, cmd_args.jobs, tmp_dir,
+                                  Progress("strip-parallel-duplicates.py: hashing", total_bytes=
+                                           Progress.input_size(*(f.name for f in cmd_args.in_files[:compare]))))
+            for f in cmd_args.in_files[:compare]:
+               f.seek(0)
+            next_kept = next(kept, None)
+            with ParallelReader(cmd_args.in_files, progress=progress) as reader, \
+                 ParallelWriter([f.name+cmd_args.ext for f in cmd_args.in_files]) as writer:
+               for columns in reader.batches():
+                  start = reader.line_count - len(columns[0])
+                  keep = [False] * len(columns[0])
+                  while next_kept is not None and next_kept < reader.line_count:
+                     keep[next_kept - start] = True
+                     next_kept = next(kept, None)
+                  writer.write_columns([compress(column, keep) for column in columns])
       else:
-         identical = True
-      if not identical:
-         for i in range(len(lines)):
-            print(lines[i], file=out_files[i], end='')
-
-   for i in range(len(cmd_args.in_files)):
-      if len(lines[i]) != 0:
-         fatal_error("File", cmd_args.in_files[i].name,
-                     "contains more lines than some other files.")
+         with ParallelReader(cmd_args.in_files, progress=progress) as reader, \
+              ParallelWriter([f.name+cmd_args.ext for f in cmd_args.in_files]) as writer:
+            seen = HashSet(cmd_args.bits) if cmd_args.global_dedup else None
+            near = near_duplicate_filter(cmd_args) if cmd_args.near is not None else None
+            for columns in reader.batches():
+               if near is not None:
+                  keep = near(columns[:compare])
+               elif seen is not None:
+                  keep = seen.add_all(row_hashes(columns[:compare], cmd_args.bits))
+               else:
+                  keep = [lines.count(lines[0]) != compare for lines in zip(*columns[:compare])]
+               writer.write_columns([compress(column, keep) for column in columns])
+   except ParallelLengthError as e:
+      fatal_error(e)
+   progress.done()
 
 if __name__ == '__main__':
    main()
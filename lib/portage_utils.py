@@ -18,22 +18,31 @@
 
 from __future__ import print_function, unicode_literals, division, absolute_import
 
+# Only cheap modules are imported here: this library is imported by every
+# script, and importing argparse, re and subprocess took over 90% of its import
+# time, so they are imported where they are needed.
 import io
+import os
 import sys
-import argparse
-import re
+import time
+from itertools import islice
 
 if sys.version_info[0] < 3:
    import __builtin__ as builtins
 else:
    import builtins
-from subprocess import Popen, PIPE
 
+# HelpAction, VerboseAction, VerboseMultiAction and DebugAction are defined on
+# first access on Python 3.7+ (see __getattr__ below), so "import *" imports
+# argparse, but "import portage_utils" alone doesn't.
 __all__ = ["printCopyright",
            "HelpAction", "VerboseAction", "VerboseMultiAction", "DebugAction",
            "set_debug", "set_verbose",
-           "error", "fatal_error", "warn", "info", "debug", "verbose",
+           "error", "fatal_error", "warn", "info", "debug", "verbose", "Progress",
            "open", "split",
+           "Codec", "register_codec", "get_codec", "ParallelGzipWriter",
+           "ParallelReader", "ParallelWriter", "ParallelLengthError",
+           "select_lines", "GzipLineIndex", "TextLineIndex", "load_line_index",
           ]
 
 current_year = 2022
@@ -51,58 +60,80 @@ def printCopyright(program_name, start_year):
    pass
 
 
-class HelpAction(argparse.Action):
-   """argparse action class for displaying the help message to stderr.
-   e.g: parser.add_argument("-h", "-help", "--help", action=HelpAction)
+def _define_actions():
+   """Define HelpAction, VerboseAction, VerboseMultiAction and DebugAction,
+   which requires importing argparse.
    """
-   def __init__(self, option_strings, dest, help="print this help message to stderr and exit"):
-      super(HelpAction, self).__init__(option_strings, dest, nargs=0,
-                                       default=argparse.SUPPRESS,
-                                       required=False, help=help)
-   def __call__(self, parser, namespace, values, option_string=None):
-      parser.print_help(file=sys.stderr)
-      sys.exit()
-
-class VerboseAction(argparse.Action):
-   """argparse action class for turning on verbose output.
-   e.g: parser.add_argument("-v", "--verbose", action=VerboseAction)
-   """
-   def __init__(self, option_strings, dest, help="print verbose output to stderr [False]"):
-      super(VerboseAction, self).__init__(option_strings, dest, nargs=0,
-                                          const=True, default=False,
+   import argparse
+
+   class HelpAction(argparse.Action):
+      """argparse action class for displaying the help message to stderr.
+      e.g: parser.add_argument("-h", "-help", "--help", action=HelpAction)
+      """
+      def __init__(self, option_strings, dest, help="print this help message to stderr and exit"):
+         super(HelpAction, self).__init__(option_strings, dest, nargs=0,
+                                          default=argparse.SUPPRESS,
                                           required=False, help=help)
+      def __call__(self, parser, namespace, values, option_string=None):
+         parser.print_help(file=sys.stderr)
+         sys.exit()
 
-   def __call__(self, parser, namespace, values, option_string=None):
-      setattr(namespace, self.dest, True)
-      set_verbose(True)
+   class VerboseAction(argparse.Action):
+      """argparse action class for turning on verbose output.
+      e.g: parser.add_argument("-v", "--verbose", action=VerboseAction)
+      """
+      def __init__(self, option_strings, dest, help="print verbose output to stderr [False]"):
+         super(VerboseAction, self).__init__(option_strings, dest, nargs=0,
+                                             const=True, default=False,
+                                             required=False, help=help)
 
-class VerboseMultiAction(argparse.Action):
-   """argparse action class increase level of verbosity in output.
-   e.g: parser.add_argument("-v", "--verbose", action=VerboseMultiAction)
-   Using multiple flags increase the verbosity multiple levels.
-   """
-   def __init__(self, option_strings, dest,
-                help="increase level of verbosity output to stderr [0]"):
-      super(VerboseMultiAction, self).__init__(option_strings, dest, nargs=0,
-                                               type=int, default=0,
-                                               required=False, help=help)
-
-   def __call__(self, parser, namespace, values, option_string=None):
-      setattr(namespace, self.dest, getattr(namespace, self.dest, 0) + 1)
-      set_verbose(True)
-
-class DebugAction(argparse.Action):
-   """argparse action class for turning on verbose output.
-   e.g: parser.add_argument("-d", "--debug", action=DebugAction)
-   """
-   def __init__(self, option_strings, dest, help="print debug output to stderr [False]"):
-      super(DebugAction, self).__init__(option_strings, dest, nargs=0,
-                                        const=True, default=False,
-                                        required=False, help=help)
+      def __call__(self, parser, namespace, values, option_string=None):
+         setattr(namespace, self.dest, True)
+         set_verbose(True)
+
+   class VerboseMultiAction(argparse.Action):
+      """argparse action class increase level of verbosity in output.
+      e.g: parser.add_argument("-v", "--verbose", action=VerboseMultiAction)
+      Using multiple flags increase the verbosity multiple levels.
+      """
+      def __init__(self, option_strings, dest,
+                   help="increase level of verbosity output to stderr [0]"):
+         super(VerboseMultiAction, self).__init__(option_strings, dest, nargs=0,
+                                                  type=int, default=0,
+                                                  required=False, help=help)
+
+      def __call__(self, parser, namespace, values, option_string=None):
+         setattr(namespace, self.dest, getattr(namespace, self.dest, 0) + 1)
+         set_verbose(True)
 
-   def __call__(self, parser, namespace, values, option_string=None):
-      setattr(namespace, self.dest, True)
-      set_debug(True)
+   class DebugAction(argparse.Action):
+      """argparse action class for turning on verbose output.
+      e.g: parser.add_argument("-d", "--debug", action=DebugAction)
+      """
+      def __init__(self, option_strings, dest, help="print debug output to stderr [False]"):
+         super(DebugAction, self).__init__(option_strings, dest, nargs=0,
+                                           const=True, default=False,
+                                           required=False, help=help)
+
+      def __call__(self, parser, namespace, values, option_string=None):
+         setattr(namespace, self.dest, True)
+         set_debug(True)
+
+   globals().update(HelpAction=HelpAction, VerboseAction=VerboseAction,
+                    VerboseMultiAction=VerboseMultiAction, DebugAction=DebugAction)
+
+if sys.version_info < (3, 7):
+   _define_actions()
+else:
+   def __getattr__(name):
+      """Define the argparse actions when first used, so that scripts not using
+      argparse don't import it (PEP 562).  "from portage_utils import
+      HelpAction" and "import *" work as usual.
+      """
+      if name in ("HelpAction", "VerboseAction", "VerboseMultiAction", "DebugAction"):
+         _define_actions()
+         return globals()[name]
+      raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 
 verbose_flag = False
@@ -147,6 +178,127 @@ def verbose(*args, **kwargs):
    if verbose_flag or debug_flag:
       print(*args, file=sys.stderr, **kwargs)
 
+
+def _format_seconds(seconds):
+   """Format a number of seconds as H:MM:SS."""
+   seconds = int(seconds)
+   return "{0}:{1:02d}:{2:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+class Progress(object):
+   """Report the progress of a long-running loop on stderr: lines and MB
+   processed, lines/s, MB/s, elapsed time and, when the size of the input is
+   known, ETA.
+
+   Reports are rate-limited by time, not by line count, so update() can be
+   called on every line and a stalled loop shows as a rate that drops.
+   On a terminal, each report overwrites the previous one.
+
+   examples:
+      progress = Progress("tool.py", total_bytes=Progress.input_size(filename))
+      for line in infile:
+         ...
+         progress.update(1, len(line))
+      progress.done()
+
+      with Progress("tool.py", total_lines=len(indices)) as progress:
+         for index in indices:
+            ...
+            progress.update()
+
+   label: prefix of the reports
+   total_bytes: size of the input, for the ETA, or None if unknown
+   total_lines: number of lines in the input, for the ETA when total_bytes is
+      not known, or None if unknown
+   interval: minimum number of seconds between reports
+   enabled: whether to report [verbose_flag or debug_flag, i.e., -v or -d]
+   stream: where to report [sys.stderr]
+   """
+   def __init__(self, label="", total_bytes=None, total_lines=None, interval=1.0,
+                enabled=None, stream=None):
+      self.label = label
+      self.total_bytes = total_bytes
+      self.total_lines = total_lines
+      self.interval = interval
+      self.enabled = verbose_flag or debug_flag if enabled is None else enabled
+      self.stream = sys.stderr if stream is None else stream
+      self.start = time.time()
+      self.next_report = self.start + interval
+      self.lines = 0
+      self.bytes = 0
+
+   @staticmethod
+   def input_size(*filenames):
+      """Return the total size of filenames, or None if it cannot be known in
+      advance, e.g., for stdin, pipes and compressed files.
+      """
+      total = 0
+      for filename in filenames:
+         if filename == "-" or filename.endswith("|") or get_codec(filename) is not None \
+            or not os.path.isfile(filename):
+            return None
+         total += os.path.getsize(filename)
+      return total
+
+   def update(self, lines=1, nbytes=0):
+      """Record that lines more lines and nbytes more bytes were processed.
+
+      For text, nbytes can be a number of characters: it is only used to
+      report MB and MB/s and estimate the ETA.
+      """
+      self.lines += lines
+      self.bytes += nbytes
+      if self.enabled:
+         now = time.time()
+         if now >= self.next_report:
+            self.next_report = now + self.interval
+            self.report(now)
+
+   def report(self, now=None, final=False):
+      """Print a progress report."""
+      if now is None:
+         now = time.time()
+      elapsed = now - self.start
+      rate = elapsed if elapsed > 0 else 1e-9
+      fields = [
+         "{0} lines".format(self.lines),
+         "{0:.1f} MB".format(self.bytes / 1e6),
+         "{0:.0f} lines/s".format(self.lines / rate),
+         "{0:.2f} MB/s".format(self.bytes / 1e6 / rate),
+         "elapsed " + _format_seconds(elapsed),
+      ]
+      if not final:
+         if self.total_bytes and self.bytes:
+            fields.append("ETA " + _format_seconds(
+               elapsed * max(self.total_bytes - self.bytes, 0) / self.bytes))
+         elif self.total_lines and self.lines:
+            fields.append("ETA " + _format_seconds(
+               elapsed * max(self.total_lines - self.lines, 0) / self.lines))
+      message = "[" + (self.label + ": " if self.label else "") + ", ".join(fields) + \
+                (", done]" if final else "]")
+      if self.stream.isatty():
+         print("\r" + message, end="\n" if final else "", file=self.stream)
+      else:
+         print(message, file=self.stream)
+      self.stream.flush()
+
+   def watch(self, lines):
+      """Yield lines, updating the progress with each one and its length."""
+      for line in lines:
+         self.update(1, len(line))
+         yield line
+
+   def done(self):
+      """Print a final report, if enabled."""
+      if self.enabled:
+         self.report(final=True)
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, exc_type, exc_value, traceback):
+      if exc_type is None:
+         self.done()
+
 def open_python2(filename, mode='r', quiet=True):
    """Transparently open files that are stdin, stdout, plain text, compressed or pipes.
 
@@ -175,10 +327,13 @@ def open_python2(filename, mode='r', quiet=True):
       else:
          fatal_error("Unsupported mode.")
    elif filename.endswith('|'):
+      from subprocess import Popen, PIPE
       theFile = Popen(filename[:-1], shell=True, executable="/bin/bash", stdout=PIPE).stdout
    elif filename.startswith('|'):
+      from subprocess import Popen, PIPE
       theFile = Popen(filename[1:], shell=True, executable="/bin/bash", stdin=PIPE).stdin
    elif filename.endswith(".gz"):
+      from subprocess import Popen, PIPE
       #theFile = gzip.open(filename, mode+'b')
       if mode == 'r':
          if quiet:
@@ -195,16 +350,275 @@ def open_python2(filename, mode='r', quiet=True):
 
    return theFile
 
+def _open_gzip(filename, mode):
+   import gzip
+   if "w" in mode:
+      # Same default compression level as the gzip command line tool.
+      return gzip.open(filename, mode, compresslevel=6)
+   return gzip.open(filename, mode)
+
+def _open_bz2(filename, mode):
+   import bz2
+   return bz2.open(filename, mode)
+
+def _open_lzma(filename, mode):
+   import lzma
+   return lzma.open(filename, mode)
+
+def _open_zstd(filename, mode):
+   try:
+      from compression import zstd  # Python >= 3.14
+   except ImportError:
+      import zstandard as zstd
+   return zstd.open(filename, mode)
+
+
+class _ProcessWriter(io.BufferedIOBase):
+   """Binary file writing to the stdin of a child process, e.g., gzip, whose
+   close() waits for the child to finish writing its output.
+
+   process: the subprocess.Popen object, started with stdin=PIPE
+   output: the file the child writes to, closed once it is done
+   """
+   def __init__(self, process, output):
+      super(_ProcessWriter, self).__init__()
+      self.process = process
+      self.output = output
+      self.name = output.name
+
+   def writable(self):
+      return True
+
+   def write(self, data):
+      if self.closed:
+         raise ValueError("write to closed file")
+      return self.process.stdin.write(data)
+
+   def flush(self):
+      if not self.process.stdin.closed:
+         self.process.stdin.flush()
+
+   def close(self):
+      if self.closed:
+         return
+      try:
+         self.process.stdin.close()
+         self.process.wait()
+      finally:
+         self.output.close()
+         super(_ProcessWriter, self).close()
+
+
+class Codec(object):
+   """A compression format that open() handles transparently.
+
+   Files are (de)compressed in-process when the Python module implementing
+   the codec is available, and through a child process running an external
+   command otherwise, or when the environment variable PORTAGE_UTILS_CODECS
+   is set to "subprocess".
+
+   name: short name of the codec, e.g., "gzip"
+   extensions: filename suffixes that select this codec, e.g., (".gz",)
+   magic: leading bytes that identify a stream in this format
+   opener: function(filename, mode) opening the file in-process in binary mode;
+      it must raise ImportError if the codec's module is not installed
+   read_cmd: command (list) writing the decompressed file to stdout
+   write_cmd: command (list) compressing stdin to stdout
+   parallel_writer: class or function(filename, threads) opening filename for
+      binary writing with compression spread over threads threads, if the
+      format supports it
+   """
+   def __init__(self, name, extensions, magic, opener=None, read_cmd=None, write_cmd=None,
+                parallel_writer=None):
+      self.name = name
+      self.extensions = tuple(extensions)
+      self.magic = magic
+      self.opener = opener
+      self.read_cmd = read_cmd
+      self.write_cmd = write_cmd
+      self.parallel_writer = parallel_writer
+      self.in_process = opener is not None  # reset when the module is missing
+
+   def open_in_process(self, filename, mode):
+      """Open filename for binary I/O through the Python module for this codec.
+
+      Decompression errors are raised as exceptions by read operations.
+      """
+      theFile = self.opener(filename, mode)
+      if "r" in mode:
+         # The codecs' own readline() is much slower than BufferedReader's.
+         theFile = io.BufferedReader(theFile, 1 << 17)
+      return theFile
+
+   def open_subprocess(self, filename, mode, quiet=True):
+      """Open filename for binary I/O through a child process.
+
+      When writing, close() returns once the child process has written the
+      whole file.
+      """
+      from subprocess import Popen, PIPE
+      if "r" in mode:
+         if self.read_cmd is None:
+            fatal_error("No command available to decompress", self.name, "file", filename)
+         stderr = builtins.open(os.devnull, "w") if quiet else None
+         return Popen(self.read_cmd + [filename], stdout=PIPE, stderr=stderr).stdout
+      else:
+         if self.write_cmd is None:
+            fatal_error("No command available to compress", self.name, "file", filename)
+         internal_file = builtins.open(filename, "wb")
+         return _ProcessWriter(Popen(self.write_cmd, close_fds=True, stdin=PIPE, stdout=internal_file),
+                               internal_file)
+
+   def open(self, filename, mode, quiet=True, threads=1):
+      """Open filename for binary I/O, in-process if possible.
+
+      filename: name of the file to open
+      mode: "rb" or "wb"
+      quiet: suppress "zcat: stdout: Broken pipe" messages from child processes.
+      threads: number of compression threads to use when writing, if the
+         codec has a parallel_writer
+      return: binary file handle to the open file.
+      """
+      if "w" in mode and threads > 1 and self.parallel_writer is not None:
+         return self.parallel_writer(filename, threads)
+      if self.in_process and os.environ.get("PORTAGE_UTILS_CODECS") != "subprocess":
+         try:
+            return self.open_in_process(filename, mode)
+         except ImportError:
+            self.in_process = False
+      return self.open_subprocess(filename, mode, quiet)
+
+
+class ParallelGzipWriter(io.BufferedIOBase):
+   """Binary file writing gzip data, compressing blocks on a thread pool like pigz.
+
+   The data is cut into blocks of block_size bytes, each compressed
+   independently as a separate gzip member; the members are written in order,
+   producing a valid multi-member gzip file that gzip, zcat and open() all
+   read as a single stream.  zlib releases the GIL while compressing, so the
+   threads really do run in parallel.  At most 2 * threads blocks are held in
+   memory at a time.
+
+   filename: name of the file to write
+   threads: number of compression threads
+   block_size: uncompressed size of each gzip member
+   compresslevel: gzip compression level
+   """
+   def __init__(self, filename, threads, block_size=1 << 20, compresslevel=6):
+      super(ParallelGzipWriter, self).__init__()
+      from concurrent.futures import ThreadPoolExecutor
+      from collections import deque
+      self.name = filename
+      self.threads = threads
+      self.block_size = block_size
+      self.compresslevel = compresslevel
+      self._file = builtins.open(filename, "wb")
+      self._pool = ThreadPoolExecutor(max_workers=threads)
+      self._pending = deque()
+      self._block = []
+      self._block_len = 0
+
+   def writable(self):
+      return True
+
+   def write(self, data):
+      if self.closed:
+         raise ValueError("write to closed file")
+      self._block.append(bytes(data))
+      self._block_len += len(data)
+      if self._block_len >= self.block_size:
+         self._submit_block()
+      return len(data)
+
+   def _compress(self, block):
+      import zlib
+      # wbits=31: gzip format; zlib.compress() only takes wbits since Python 3.11.
+      compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, 31)
+      return compressor.compress(block) + compressor.flush()
+
+   def _submit_block(self):
+      block = b"".join(self._block)
+      self._block = []
+      self._block_len = 0
+      self._pending.append(self._pool.submit(self._compress, block))
+      while len(self._pending) > 2 * self.threads or \
+            (self._pending and self._pending[0].done()):
+         self._file.write(self._pending.popleft().result())
+
+   def close(self):
+      if self.closed:
+         return
+      try:
+         if self._block_len or not self._pending:
+            # Always write at least one member, so an empty file is still valid gzip.
+            self._submit_block()
+         while self._pending:
+            self._file.write(self._pending.popleft().result())
+      finally:
+         self._pool.shutdown()
+         self._file.close()
+         super(ParallelGzipWriter, self).close()
+
+
+_codecs = []
+
+def register_codec(codec):
+   """Register codec so open() uses it for files ending with its extensions.
+
+   A codec registered later takes precedence over earlier ones for the same
+   extension.
+   """
+   _codecs.insert(0, codec)
+
+def get_codec(filename):
+   """Return the codec selected by the extension of filename, or None."""
+   for codec in _codecs:
+      if filename.endswith(codec.extensions):
+         return codec
+   return None
+
+def _sniff_codec(filename):
+   """Return the codec whose magic number starts filename, or None for plain files."""
+   with builtins.open(filename, "rb") as f:
+      head = f.read(8)
+   for codec in _codecs:
+      if head.startswith(codec.magic):
+         return codec
+   return None
+
+register_codec(Codec("zstd", (".zst", ".zstd"), b"\x28\xb5\x2f\xfd", _open_zstd,
+                     read_cmd=["zstd", "-dcq"], write_cmd=["zstd", "-cq"]))
+register_codec(Codec("xz", (".xz", ".lzma"), b"\xfd7zXZ\x00", _open_lzma,
+                     read_cmd=["xz", "-dc"], write_cmd=["xz", "-c"]))
+register_codec(Codec("bzip2", (".bz2",), b"BZh", _open_bz2,
+                     read_cmd=["bzip2", "-dc"], write_cmd=["bzip2", "-c"]))
+register_codec(Codec("gzip", (".gz",), b"\x1f\x8b", _open_gzip,
+                     read_cmd=["zcat", "-f"], write_cmd=["gzip"],
+                     parallel_writer=ParallelGzipWriter))
+
+
 DEFAULT_ENCODING_VALUE=object()  # Sentinel object so we know encoding was not specified
-def open_python3(filename, mode='r', quiet=True, encoding=DEFAULT_ENCODING_VALUE, newline=None):
+def open_python3(filename, mode='r', quiet=True, encoding=DEFAULT_ENCODING_VALUE, newline=None,
+                 threads=None):
    """Transparently open files that are stdin, stdout, plain text, compressed or pipes.
 
    This version of open() is optimized for Python 3, and supports the encoding
    and newline parameters.
 
+   Compressed files are recognized by their extension (.gz, .bz2, .xz, .lzma,
+   .zst, see register_codec()) and (de)compressed in-process when possible,
+   so corrupt input raises an exception instead of being silently truncated.
+   As with zcat -f, a file with a compression extension that is not actually
+   compressed is read as is.
+
+   .gz output can be compressed by several threads, like pigz, by setting the
+   threads parameter or the PORTAGE_GZIP_THREADS environment variable.
+
    examples: open("-")
       open("file.txt", encoding="latin1")
       open("file.gz", newline="\n")
+      open("file.xz", "w")
+      open("file.gz", "w", threads=8)
       open("zcat file.gz | grep a |")
 
    filename: name of the file to open
@@ -212,6 +626,7 @@ def open_python3(filename, mode='r', quiet=True, encoding=DEFAULT_ENCODING_VALUE
    quiet:  suppress "zcat: stdout: Broken pipe" messages.
    encoding: same as in builtins.open() but defaults to "utf8" for text modes
    newline: same as in builtins.open()
+   threads: number of threads compressing .gz output [$PORTAGE_GZIP_THREADS or 1]
    return: file handle to the open file.
    """
 
@@ -225,6 +640,8 @@ def open_python3(filename, mode='r', quiet=True, encoding=DEFAULT_ENCODING_VALUE
    if len(filename) == 0:
       fatal_error("You must provide a filename")
 
+   codec = get_codec(filename)
+
    if filename == "-":
       if mode in ('r', 'rt'):
          # Notes on this solution: the now more standard
@@ -234,38 +651,41 @@ def open_python3(filename, mode='r', quiet=True, encoding=DEFAULT_ENCODING_VALUE
          # stdin/stdout (at least not with 3.6).
          theFile = builtins.open(sys.stdin.fileno(), mode, encoding=encoding, newline=newline)
       elif mode == "rb":
-         theFile = sys.stdin
+         theFile = sys.stdin.buffer
       elif mode in ('w', 'wt'):
          theFile = builtins.open(sys.stdout.fileno(), mode, encoding=encoding, newline=newline)
       elif mode == "wb":
-         theFile = sys.stdout
+         theFile = sys.stdout.buffer
       else:
          fatal_error("Unsupported mode.")
    elif filename.endswith('|'):
+      from subprocess import Popen, PIPE
       theFile = Popen(filename[:-1], shell=True, executable="/bin/bash", stdout=PIPE).stdout
       if "b" not in mode:
          theFile = io.TextIOWrapper(theFile, encoding=encoding, newline=newline)
    elif filename.startswith('|'):
+      from subprocess import Popen, PIPE
       theFile = Popen(filename[1:], shell=True, executable="/bin/bash", stdin=PIPE).stdin
       if "b" not in mode:
          theFile = io.TextIOWrapper(theFile, encoding=encoding, newline=newline)
-   elif filename.endswith(".gz"):
-      #theFile = gzip.open(filename, mode+'b')
+   elif codec is not None:
       if mode in ('r', 'rt', 'rb'):
-         if quiet:
-            theFile = Popen(["zcat", "-f", filename], stdout=PIPE,
-                            stderr=open('/dev/null', 'w')).stdout
+         codec = _sniff_codec(filename)
+         if codec is None:
+            theFile = builtins.open(filename, "rb")
          else:
-            theFile = Popen(["zcat", "-f", filename], stdout=PIPE).stdout
-         if "b" not in mode:
-            theFile = io.TextIOWrapper(theFile, encoding=encoding, newline=newline)
+            theFile = codec.open(filename, "rb", quiet)
       elif mode in ('w', 'wt', 'wb'):
-         internal_file = builtins.open(filename, "wb")
-         theFile = Popen(["gzip"], close_fds=True, stdin=PIPE, stdout=internal_file).stdin
-         if "b" not in mode:
-            theFile = io.TextIOWrapper(theFile, encoding=encoding, newline=newline)
+         if threads is None:
+            threads = os.environ.get("PORTAGE_GZIP_THREADS", "1")
+            if not threads.isdigit() or int(threads) < 1:
+               fatal_error("PORTAGE_GZIP_THREADS must be a positive integer, not", repr(threads))
+            threads = int(threads)
+         theFile = codec.open(filename, "wb", quiet, threads)
       else:
-         fatal_error("Unsupported mode for gz files.")
+         fatal_error("Unsupported mode for compressed files.")
+      if "b" not in mode:
+         theFile = io.TextIOWrapper(theFile, encoding=encoding, newline=newline)
    else:
       theFile = builtins.open(filename, mode, encoding=encoding, newline=newline)
 
@@ -277,8 +697,9 @@ else:
    open = open_python3
 
 # Regular expression to match whitespace the same way that split() in
-# str_utils.cc does, i.e. sequence of spaces, tabs, and/or newlines.
-split_re = re.compile('[ \t\n]+')
+# str_utils.cc does, i.e. sequence of spaces, tabs, and/or newlines; compiled
+# on first use.
+_split_re = None
 
 def split(s):
    """Split s into tokens the same way split() in str_utils.cc does, i.e.
@@ -288,8 +709,565 @@ def split(s):
    s: string to be split into token
    returns: list of string tokens
    """
+   global _split_re
+   if _split_re is None:
+      import re
+      _split_re = re.compile('[ \t\n]+')
    ss = s.strip(' \t\n')
-   return [] if len(ss) == 0 else split_re.split(ss)
+   return [] if len(ss) == 0 else _split_re.split(ss)
+
+
+class ParallelLengthError(ValueError):
+   """Raised by ParallelReader when its files don't all have the same number of lines."""
+   pass
+
+
+class ParallelReader(object):
+   """Read line-aligned files in lockstep, a batch of lines at a time.
+
+   Iterating over a ParallelReader yields one tuple of lines per line number;
+   batches() yields column batches instead, i.e., one list of lines per file,
+   which lets callers process a whole batch with list comprehensions,
+   itertools.compress() and writelines().
+
+   examples:
+      with ParallelReader([src_filename, tgt_filename]) as reader:
+         for src, tgt in reader:
+            ...
+
+      with ParallelReader(filenames) as reader, ParallelWriter(out_filenames) as writer:
+         for columns in reader.batches():
+            keep = [...]
+            writer.write_columns([compress(column, keep) for column in columns])
+
+   files: open files or filenames; filenames are opened with open() and
+      closed by close()
+   batch_size: number of lines read from each file at a time
+   progress: optional Progress to update with the lines and characters read
+   newline: as with open(), for the files opened from filenames
+   raises: ParallelLengthError when the files don't all have the same number
+      of lines, naming the shorter file and its length
+   """
+   def __init__(self, files, batch_size=10000, progress=None, newline=None):
+      if not files:
+         raise ValueError("ParallelReader needs at least one file")
+      self.opened = [not hasattr(f, "read") for f in files]
+      open_args = {} if newline is None else {"newline": newline}
+      self.files = [open(f, **open_args) if opened else f for f, opened in zip(files, self.opened)]
+      self.batch_size = batch_size
+      self.progress = progress
+      self.line_count = 0
+
+   def batches(self):
+      """Yield tuples of columns, one list of lines per file, each holding
+      batch_size lines, except the last one.
+      """
+      while True:
+         columns = tuple(list(islice(f, self.batch_size)) for f in self.files)
+         size = len(columns[0])
+         if any(len(column) != size for column in columns):
+            lengths = [len(column) for column in columns]
+            shortest, longest = lengths.index(min(lengths)), lengths.index(max(lengths))
+            raise ParallelLengthError("{0} has {1} lines, but {2} has more".format(
+               self._name(shortest), self.line_count + lengths[shortest], self._name(longest)))
+         if size == 0:
+            return
+         self.line_count += size
+         if self.progress is not None:
+            self.progress.update(size, sum(sum(map(len, column)) for column in columns)
+                                       if self.progress.enabled else 0)
+         yield columns
+         if size < self.batch_size:
+            # islice() only stops early at the end of the file, so all files are done
+            return
+
+   def __iter__(self):
+      for columns in self.batches():
+         for lines in zip(*columns):
+            yield lines
+
+   def _name(self, i):
+      return getattr(self.files[i], "name", "file {0}".format(i + 1))
+
+   def close(self):
+      for f, opened in zip(self.files, self.opened):
+         if opened:
+            f.close()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
+
+
+class ParallelWriter(object):
+   """Write line-aligned files in lockstep, with one writelines() call per file
+   per batch instead of one write() call per line.
+
+   files: open files or filenames; filenames are opened with open(f, "w") and
+      closed by close()
+   batch_size: number of rows buffered by write() before they are written out
+   """
+   def __init__(self, files, batch_size=10000):
+      self.opened = [not hasattr(f, "write") for f in files]
+      self.files = [open(f, "w") if opened else f for f, opened in zip(files, self.opened)]
+      self.batch_size = batch_size
+      self.rows = []
+
+   def write(self, lines):
+      """Buffer one row, i.e., a sequence with one line per file."""
+      self.rows.append(lines)
+      if len(self.rows) >= self.batch_size:
+         self.flush()
+
+   def write_columns(self, columns):
+      """Write a column batch, i.e., one iterable of lines per file, as is."""
+      self.flush()
+      for f, column in zip(self.files, columns):
+         f.writelines(column)
+
+   def flush(self):
+      """Write out the rows buffered by write()."""
+      if self.rows:
+         for f, column in zip(self.files, zip(*self.rows)):
+            f.writelines(column)
+         self.rows = []
+
+   def close(self):
+      self.flush()
+      for f, opened in zip(self.files, self.opened):
+         if opened:
+            f.close()
+         else:
+            f.flush()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
+
+
+def select_lines(infile, numbers):
+   """Yield the lines of infile at the given line numbers, reading sequentially.
+
+   infile: file or iterable of lines
+   numbers: non-decreasing iterable of 1-based line numbers; repeats are allowed
+   raises: IndexError(n) if infile has fewer than n lines
+   """
+   infile = iter(infile)
+   line_number = 0
+   line = None
+   for n in numbers:
+      if n > line_number:
+         line = next(islice(infile, n - line_number - 1, None), None)
+         if line is None:
+            raise IndexError(n)
+         line_number = n
+      elif n < line_number or n < 1:
+         raise ValueError("line numbers must be sorted and >= 1: {0}".format(n))
+      yield line
+
+
+LINE_INDEX_SUFFIX = ".lineidx"
+
+def _index_file_stat(filename):
+   st = os.stat(filename)
+   return st.st_size, st.st_mtime_ns
+
+def _write_index_file(index_filename, magic, header, arrays):
+   """Write a sidecar index: magic, then header (tuple of ints), then arrays."""
+   import struct
+   with builtins.open(index_filename, "wb") as f:
+      f.write(magic)
+      f.write(struct.pack("<{0}q".format(len(header)), *header))
+      f.write(struct.pack("<{0}q".format(len(arrays)), *(len(a) for a in arrays)))
+      for a in arrays:
+         if sys.byteorder == "big":
+            a = a[:]
+            a.byteswap()
+         a.tofile(f)
+
+def _read_index_file(index_filename, magic, header_len, typecodes):
+   """Read a sidecar index written by _write_index_file().
+
+   return: (header, arrays), or None if index_filename is not such an index.
+   """
+   import struct
+   from array import array
+   with builtins.open(index_filename, "rb") as f:
+      if f.read(len(magic)) != magic:
+         return None
+      header = struct.unpack("<{0}q".format(header_len), f.read(8 * header_len))
+      lengths = struct.unpack("<{0}q".format(len(typecodes)), f.read(8 * len(typecodes)))
+      arrays = []
+      for typecode, length in zip(typecodes, lengths):
+         a = array(typecode)
+         a.fromfile(f, length)
+         if sys.byteorder == "big":
+            a.byteswap()
+         arrays.append(a)
+   return header, arrays
+
+
+class GzipLineIndex(object):
+   """Checkpoint index giving random access to the lines of a .gz file (zran-style).
+
+   The index records decompressor checkpoints, each with its offset in the
+   compressed file, its offset in the uncompressed text, and the number of
+   newlines before it, so that reading line N decompresses only from the
+   closest checkpoint before it.  Python's zlib cannot resume inflating at an
+   arbitrary bit of a deflate stream, so checkpoints are placed at gzip member
+   boundaries, no closer than span uncompressed bytes apart: files written
+   with open(..., threads=N) or PORTAGE_GZIP_THREADS (or bgzip) have a member
+   every block and are fully seekable, whereas a single-member file can only
+   be read from its start.
+
+   The index is saved to filename + ".lineidx" and only used by load() while
+   filename's size and modification time are unchanged.
+
+   Typical use:
+      index = GzipLineIndex.load("corpus.gz") or GzipLineIndex.build("corpus.gz").save()
+      line = index.get_line(123456)
+   """
+   MAGIC = b"PTPGZIX1"
+   CHUNK_SIZE = 1 << 17
+
+   def __init__(self, filename, file_stat, span, num_lines, coffsets, uoffsets,
+                lines_before, line_starts, encoding="utf-8"):
+      self.filename = filename
+      self.file_stat = file_stat
+      self.span = span
+      self.num_lines = num_lines
+      self.coffsets = coffsets
+      self.uoffsets = uoffsets
+      self.lines_before = lines_before
+      self.line_starts = line_starts
+      self.encoding = encoding
+
+   @classmethod
+   def build(cls, filename, span=1 << 20, encoding="utf-8", progress=None):
+      """Scan filename and return its index.
+
+      span: minimum distance between checkpoints, in uncompressed bytes
+      progress: a Progress to update with the uncompressed lines and bytes scanned
+      raises: zlib.error or EOFError if filename is not a valid gzip file
+      """
+      from array import array
+      file_stat = _index_file_stat(filename)
+      coffsets, uoffsets, lines_before = array("q", [0]), array("q", [0]), array("q", [0])
+      line_starts = array("b", [1])
+      uoffset = lines = 0
+      at_line_start = True
+      for member_start, chunk in cls._decompress(filename, 0):
+         if chunk is None:
+            if uoffset - uoffsets[-1] >= span:
+               coffsets.append(member_start)
+               uoffsets.append(uoffset)
+               lines_before.append(lines)
+               line_starts.append(at_line_start)
+         elif chunk:
+            chunk_lines = chunk.count(b"\n")
+            uoffset += len(chunk)
+            lines += chunk_lines
+            if progress is not None:
+               progress.update(chunk_lines, len(chunk))
+            at_line_start = chunk.endswith(b"\n")
+      num_lines = lines if at_line_start else lines + 1
+      return cls(filename, file_stat, span, num_lines, coffsets, uoffsets,
+                 lines_before, line_starts, encoding)
+
+   @classmethod
+   def load(cls, filename, encoding="utf-8"):
+      """Return the saved index of filename, or None if it is missing or stale."""
+      index_filename = filename + LINE_INDEX_SUFFIX
+      if not os.path.exists(index_filename):
+         return None
+      result = _read_index_file(index_filename, cls.MAGIC, 4, "qqqb")
+      if result is None:
+         return None
+      (size, mtime_ns, span, num_lines), arrays = result
+      if (size, mtime_ns) != _index_file_stat(filename):
+         return None
+      return cls(filename, (size, mtime_ns), span, num_lines, *arrays, encoding=encoding)
+
+   def save(self):
+      """Save this index next to its gzip file, and return self."""
+      _write_index_file(self.filename + LINE_INDEX_SUFFIX, self.MAGIC,
+                        self.file_stat + (self.span, self.num_lines),
+                        (self.coffsets, self.uoffsets, self.lines_before, self.line_starts))
+      return self
+
+   @classmethod
+   def _decompress(cls, filename, coffset):
+      """Yield (member_start, None) at each gzip member start from coffset on,
+      and (member_start, uncompressed_chunk) for the data of each member.
+      """
+      import zlib
+      with builtins.open(filename, "rb") as f:
+         f.seek(coffset)
+         total = coffset
+         data = b""
+         decompressor = None
+         while True:
+            if not data:
+               data = f.read(cls.CHUNK_SIZE)
+               if not data:
+                  break
+               total += len(data)
+            if decompressor is None:
+               # Like the gzip module, skip zero padding between and after members.
+               data = data.lstrip(b"\0")
+               if not data:
+                  continue
+               member_start = total - len(data)
+               yield member_start, None
+               decompressor = zlib.decompressobj(31)
+            yield member_start, decompressor.decompress(data)
+            if decompressor.eof:
+               data = decompressor.unused_data
+               decompressor = None
+            else:
+               data = b""
+         if decompressor is not None:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+   def _checkpoint(self, n):
+      """Return the index of the last checkpoint from which line n can be reached."""
+      from bisect import bisect_left, bisect_right
+      i = bisect_right(self.lines_before, n - 1) - 1
+      if self.lines_before[i] == n - 1 and not self.line_starts[i]:
+         # Line n starts before checkpoint i, so back up further.
+         i = bisect_left(self.lines_before, n - 1) - 1
+      return i
+
+   def _read_from(self, i):
+      """Yield the uncompressed chunks from checkpoint i to the end of the file."""
+      for _, chunk in self._decompress(self.filename, self.coffsets[i]):
+         if chunk:
+            yield chunk
+
+   def _lines_from(self, i, skip):
+      """Yield the raw lines following the first skip newlines from checkpoint i."""
+      pending = b""
+      for chunk in self._read_from(i):
+         if skip:
+            count = chunk.count(b"\n")
+            if count < skip:
+               skip -= count
+               continue
+            pos = -1
+            for _ in range(skip):
+               pos = chunk.index(b"\n", pos + 1)
+            chunk = chunk[pos + 1:]
+            skip = 0
+         lines = (pending + chunk).split(b"\n")
+         pending = lines.pop()
+         for line in lines:
+            yield line + b"\n"
+      if pending:
+         yield pending
+
+   def select(self, numbers):
+      """Yield the lines at the given non-decreasing 1-based line numbers.
+
+      The file is read forward from the current position when that is at
+      least as close as the nearest checkpoint, and from that checkpoint
+      otherwise.
+      raises: IndexError(n) if the file has fewer than n lines
+      """
+      lines = None
+      line_number = 0  # number of the last line read from lines
+      line = None
+      for n in numbers:
+         if n < line_number or n < 1:
+            raise ValueError("line numbers must be sorted and >= 1: {0}".format(n))
+         if n > self.num_lines:
+            raise IndexError(n)
+         if n > line_number:
+            i = self._checkpoint(n)
+            if lines is None or self.lines_before[i] > line_number:
+               lines = self._lines_from(i, n - 1 - self.lines_before[i])
+               line_number = n - 1
+            for line in lines:
+               line_number += 1
+               if line_number == n:
+                  break
+         yield line.decode(self.encoding)
+
+   def get_line(self, n):
+      """Return line n (1-based), including its newline."""
+      for line in self.select((n,)):
+         return line
+
+   def get_lines(self, numbers):
+      """Return the list of lines for numbers, e.g., a range of line numbers."""
+      return list(self.select(numbers))
+
+
+class TextLineIndex(object):
+   """Index of line offsets giving random access to the lines of a plain text file.
+
+   The byte offset of every k-th line is kept in a compact array, and lines
+   are read through mmap, so looking up line N costs one array access plus a
+   scan over at most k-1 lines, without reading the rest of the file.  k=1
+   gives true O(1) lookups at 8 bytes per line; larger k trade lookup time
+   for a smaller index.
+
+   The index is saved to filename + ".lineidx" and only used by load() while
+   filename's size and modification time are unchanged.
+
+   Typical use:
+      index = TextLineIndex.load("corpus.txt") or TextLineIndex.build("corpus.txt").save()
+      line = index.get_line(123456)
+      lines = index.get_lines(range(1000, 2000))
+   """
+   MAGIC = b"PTPTXIX1"
+
+   def __init__(self, filename, file_stat, k, num_lines, offsets, encoding="utf-8"):
+      self.filename = filename
+      self.file_stat = file_stat
+      self.k = k
+      self.num_lines = num_lines
+      self.offsets = offsets
+      self.encoding = encoding
+      self._mmap = None
+
+   @classmethod
+   def build(cls, filename, k=1, encoding="utf-8", progress=None):
+      """Scan filename and return its index, with the offset of every k-th line.
+
+      progress: a Progress to update with the lines and bytes scanned
+      """
+      from array import array
+      file_stat = _index_file_stat(filename)
+      offsets = array("q")
+      offset = num_lines = 0
+      with builtins.open(filename, "rb") as f:
+         while True:
+            lines = list(islice(f, k))
+            if not lines:
+               break
+            offsets.append(offset)
+            size = sum(map(len, lines))
+            offset += size
+            num_lines += len(lines)
+            if progress is not None:
+               progress.update(len(lines), size)
+      return cls(filename, file_stat, k, num_lines, offsets, encoding)
+
+   @classmethod
+   def load(cls, filename, encoding="utf-8"):
+      """Return the saved index of filename, or None if it is missing or stale."""
+      index_filename = filename + LINE_INDEX_SUFFIX
+      if not os.path.exists(index_filename):
+         return None
+      result = _read_index_file(index_filename, cls.MAGIC, 4, "q")
+      if result is None:
+         return None
+      (size, mtime_ns, k, num_lines), (offsets,) = result
+      if (size, mtime_ns) != _index_file_stat(filename):
+         return None
+      return cls(filename, (size, mtime_ns), k, num_lines, offsets, encoding)
+
+   def save(self):
+      """Save this index next to its text file, and return self."""
+      _write_index_file(self.filename + LINE_INDEX_SUFFIX, self.MAGIC,
+                        self.file_stat + (self.k, self.num_lines), (self.offsets,))
+      return self
+
+   def close(self):
+      if self._mmap is not None:
+         self._mmap.close()
+         self._mmap = None
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
+
+   def _map(self):
+      if self._mmap is None:
+         import mmap
+         with builtins.open(self.filename, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      return self._mmap
+
+   def _line_start(self, n):
+      """Return the byte offset of line n."""
+      if n < 1:
+         raise ValueError("line numbers must be >= 1: {0}".format(n))
+      if n > self.num_lines:
+         raise IndexError(n)
+      mm = self._map()
+      offset = self.offsets[(n - 1) // self.k]
+      for _ in range((n - 1) % self.k):
+         offset = mm.find(b"\n", offset) + 1
+      return offset
+
+   def _line_end(self, offset):
+      """Return the byte offset just past the line starting at offset."""
+      end = self._map().find(b"\n", offset)
+      return self.file_stat[0] if end < 0 else end + 1
+
+   def select(self, numbers):
+      """Yield the lines at the given non-decreasing 1-based line numbers.
+
+      raises: IndexError(n) if the file has fewer than n lines
+      """
+      line_number = 0   # number of the last line read
+      end = 0           # offset just past that line
+      line = None
+      for n in numbers:
+         if n < line_number or n < 1:
+            raise ValueError("line numbers must be sorted and >= 1: {0}".format(n))
+         if n > line_number:
+            if n == line_number + 1:
+               start = end
+               if n > self.num_lines:
+                  raise IndexError(n)
+            else:
+               start = self._line_start(n)
+            end = self._line_end(start)
+            line = self._mmap[start:end].decode(self.encoding)
+            line_number = n
+         yield line
+
+   def get_line(self, n):
+      """Return line n (1-based), including its newline."""
+      start = self._line_start(n)
+      return self._mmap[start:self._line_end(start)].decode(self.encoding)
+
+   def get_lines(self, numbers):
+      """Return the list of lines for numbers, e.g., a range of line numbers.
+
+      A range of consecutive lines is read as a single slice of the file.
+      """
+      if isinstance(numbers, range) and numbers.step == 1 and len(numbers) > 0:
+         start = self._line_start(numbers[0])
+         end = self._line_end(self._line_start(numbers[-1]))
+         lines = self._mmap[start:end].split(b"\n")
+         if lines[-1] == b"":
+            lines.pop()
+            return [line.decode(self.encoding) + "\n" for line in lines]
+         last = lines.pop()
+         return [line.decode(self.encoding) + "\n" for line in lines] + [last.decode(self.encoding)]
+      return list(self.select(numbers))
+
+
+def load_line_index(filename, encoding="utf-8"):
+   """Return the valid sidecar line index of filename, or None if there isn't one.
+
+   return: a GzipLineIndex for .gz files, a TextLineIndex for uncompressed
+      files, or None.
+   """
+   if filename.endswith(".gz"):
+      return GzipLineIndex.load(filename, encoding)
+   if get_codec(filename) is not None:
+      return None
+   return TextLineIndex.load(filename, encoding)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# @file bench_clean_utf8.py
+# @brief Benchmark CleanUTF8.clean_line() and clean_bytes() against
+# clean_line_reference().
+#
+# The corpus mixes the English, French, Chinese and "dirty" test files from
+# this repo, repeated to the requested number of lines: a best case for the cache.
+#
+# Usage: python3 bench_clean_utf8.py [num_lines]
+
+import io
+import os
+import sys
+import time
+
+from clean_utf8 import CleanUTF8, read_buffers
+from clean_line_reference import clean_line_reference
+
+num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+tests_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sources = [
+    "clean_utf8/clean_utf8.txt",
+    "basics/src/dirty-utf8",
+    "lfl2tmx.pl/permission_hoc_en.txt",
+    "lfl2tmx.pl/permission_hoc_fr.txt",
+    "utokenize.pl/chinese-punc",
+    "utokenize.pl/ch-punc-utf8",
+    "utokenize.pl/brackets.utf8",
+]
+sample = []
+for source in sources:
+    with open(os.path.join(tests_dir, source), encoding="utf8", newline="\n") as f:
+        # Stripped, as clean_utf8.py does before cleaning
+        sample.extend(map(str.strip, f))
+corpus = (sample * (num_lines // len(sample) + 1))[:num_lines]
+size = sum(len(line.encode("utf8")) for line in corpus)
+corpus_bytes = "".join(line + "\n" for line in corpus).encode("utf8")
+
+for options in (
+    dict(),
+    dict(wide_punct=True, phrase_table=True),
+    dict(wide_punct=True, normalization_type="NFKC"),
+    dict(extended_crtl_character_filtering=True),
+    dict(wide_punct=True, normalization_type="NFKC", cache_memory=10 ** 7),
+):
+    clean = CleanUTF8(**options)
+    print(options or "defaults")
+    reference = lambda line: clean_line_reference(clean, line)
+    for name, method in ("clean_line_reference", reference), ("clean_line", clean.clean_line):
+        start = time.time()
+        for line in corpus:
+            method(line)
+        elapsed = time.time() - start
+        print("   {:22}: {:9.0f} lines/s {:6.1f} MB/s".format(
+            name, num_lines / elapsed, size / elapsed / 1e6))
+    start = time.time()
+    for buffer in read_buffers(io.BytesIO(corpus_bytes)):
+        clean.clean_bytes(buffer)
+    elapsed = time.time() - start
+    print("   {:22}: {:9.0f} lines/s {:6.1f} MB/s".format(
+        "clean_bytes", num_lines / elapsed, size / elapsed / 1e6))
@@ -0,0 +1,52 @@
+# @file clean_line_reference.py
+# @brief The original implementation of CleanUTF8.clean_line(), one regular
+# expression per rule, kept as the reference its output must be identical to,
+# see compare_engines.py, and as the baseline for benchmarking it, see
+# bench_clean_utf8.py.
+
+import re
+from unicodedata import normalize
+
+from clean_utf8 import CleanUTF8
+
+re_hyphens = re.compile(r"[\u001E\u00AD\u2011]")
+re_dhyphens = re.compile(r"\x1F")
+re_space = re.compile(r"[\u2060\uFEFF\u00A0\u2007\u202F\u2028\u2029]")
+re_ctrl = re.compile(r"[\x01-\x09\x0B\x0C\x0E-\x1D\x7F]")
+re_crlf = re.compile(r"\x0D$")
+re_phrase_table = re.compile(r"(^| )\|\|\|(?= |$)")
+re_wide = re.compile(r"([，。：）（；？﹗．﹪﹡﹟])")
+re_mspace = re.compile(r"\s+")  # \s => [ \t\n\r\f\v]
+wide_table = str.maketrans("，。：）（；？﹗．﹪﹡﹟", ",.:)(;?!.%*#")
+
+
+def clean_line_reference(clean: CleanUTF8, line: str) -> str:
+    """
+    Apply the rules of clean.clean_line(), with clean's options, to line.
+    """
+    assert isinstance(line, str)
+    line = line.rstrip()
+
+    if clean.normalization_type is not None:
+        line = normalize(clean.normalization_type, line)
+
+    line = re_hyphens.sub("-", line)
+    line = re_dhyphens.sub("", line)
+    line = re_space.sub(" ", line)
+    line = re_ctrl.sub(" ", line)
+    line = re_crlf.sub("", line)
+
+    if clean.phrase_table:
+        line = re_phrase_table.sub(" ___|||___", line)
+
+    if clean.wide_punct:
+        line = re_wide.sub(r" \g<1> ", line)
+        line = line.translate(wide_table)
+
+    line = re_mspace.sub(" ", line)
+    line = line.strip()
+
+    if clean.re_ctrl_extended is not None:
+        line = clean.re_ctrl_extended.sub("", line)
+
+    return line
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# @file compare_engines.py
+# @brief Check that CleanUTF8.clean_line() gives exactly the same output as
+# clean_line_reference(), and CleanUTF8.clean_bytes() the same as
+# clean_utf8.py in text mode, with every combination of options, on the test
+# files and on random lines full of the characters the rules apply to.
+
+import itertools
+import random
+import sys
+
+from clean_utf8 import CleanUTF8, WHITESPACE
+from clean_line_reference import clean_line_reference
+
+# The fast path relies on WHITESPACE listing every character str.split() splits on.
+assert set(WHITESPACE + " ") == {c for c in map(chr, range(sys.maxunicode + 1)) if c.isspace()}
+
+files = sys.argv[1:]
+lines = []
+for filename in files:
+    with open(filename, encoding="utf8", newline="\n") as f:
+        lines.extend(f)
+
+alphabet = (
+    "aé字 \t\r\n\x00\x01\x0b\x1c\x1e\x1f\x7f\x85\xa0\xad‑⁠﻿"
+    "    　​́ﬁ|||，。：）（；？﹗．﹪﹡﹟"
+)
+rng = random.Random(2026)
+for _ in range(10000):
+    lines.append("".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))))
+    # Mostly clean lines, to exercise the fast path
+    lines.append("".join(rng.choice("ab é字 ́|") for _ in range(rng.randint(0, 12))))
+    # Pure ASCII lines, for the byte-level rules
+    lines.append("".join(rng.choice("a| \t\r\x00\x01\x0b\x1c\x1d\x1e\x1f\x7f")
+                         for _ in range(rng.randint(0, 12))))
+lines.extend(["|||", " ||| ", "|||\r\x1f", "，|||", "a|||，", "\x01||| ⁠|||"])
+
+failures = 0
+for wide_punct, phrase_table, extended, normalization_type in itertools.product(
+    (False, True), (False, True), (False, True), (None, "NFC", "NFD", "NFKC", "NFKD")
+):
+    clean = CleanUTF8(wide_punct, phrase_table, extended, normalization_type)
+    for line in lines:
+        if clean.clean_line(line) != clean_line_reference(clean, line):
+            failures += 1
+            if failures <= 10:
+                print("Mismatch with", (wide_punct, phrase_table, extended, normalization_type),
+                      "on", repr(line), ":", repr(clean.clean_line(line)), "!=",
+                      repr(clean_line_reference(clean, line)))
+
+    # clean_utf8.py reads lines split on \n only, and strips them before cleaning.
+    text = "\n".join(lines) + "\n"
+    text_mode = "".join(clean.clean_line(line.strip()) + "\n" for line in text.split("\n")[:-1])
+    if clean.clean_bytes(text.encode("utf8")) != text_mode.encode("utf8"):
+        failures += 1
+        print("clean_bytes() mismatch with", (wide_punct, phrase_table, extended, normalization_type))
+
+    # Instrumenting must not change the output, and the byte-level rules must
+    # count the same changes as the str rules.
+    text_stats = CleanUTF8(wide_punct, phrase_table, extended, normalization_type, instrument=True)
+    bytes_stats = CleanUTF8(wide_punct, phrase_table, extended, normalization_type, instrument=True)
+    if (
+        "".join(text_stats.clean_line(line.strip()) + "\n" for line in text.split("\n")[:-1])
+        != text_mode
+        or bytes_stats.clean_bytes(text.encode("utf8")) != text_mode.encode("utf8")
+    ):
+        failures += 1
+        print("Instrumented mismatch with", (wide_punct, phrase_table, extended, normalization_type))
+    if text_stats.rule_counts != bytes_stats.rule_counts:
+        failures += 1
+        print("Rule counts mismatch with", (wide_punct, phrase_table, extended, normalization_type),
+              text_stats.rule_counts, bytes_stats.rule_counts)
+
+# With a cache small enough to evict entries, on lines seen several times
+cached = CleanUTF8(True, True, True, "NFKC", cache_memory=50000)
+uncached = CleanUTF8(True, True, True, "NFKC")
+for line in lines + lines[:5000] + lines[-5000:]:
+    if cached.clean_line(line) != uncached.clean_line(line):
+        failures += 1
+        print("Mismatch with the cache on", repr(line))
+assert 0 < cached.cache_used <= cached.cache_memory
+assert cached.cache_hits > 0
+
+if failures:
+    print(failures, "mismatches")
+    sys.exit(1)
+print("Identical output on", len(lines), "lines with all option combinations.")
+print("Fast path taken for", clean.fast_path_count, "lines with all options on.")
+print("With a cache:", cached.stats())
+print("Rule counts with all options on:", text_stats.rule_counts)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# @file bench_codecs.py
+# @brief Benchmark reading compressed files with portage_utils.open(), comparing
+# the in-process codecs with the external zcat/bzip2/xz commands, and writing
+# .gz files with one vs several compression threads.
+#
+# Usage: python3 bench_codecs.py [num_lines]
+
+import os
+import sys
+import tempfile
+import time
+
+import portage_utils
+from portage_utils import open
+
+
+def read_all(codec, filename, how):
+    if how == "subprocess":
+        binary = codec.open_subprocess(filename, "rb")
+    else:
+        binary = codec.open_in_process(filename, "rb")
+    count = size = 0
+    with binary:
+        for line in binary:
+            count += 1
+            size += len(line)
+    return count, size
+
+
+num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+text = "This is a fairly typical line of text àçéïôù, number {}.\n"
+
+tmp_dir_root = "/tmp" if os.path.exists("/tmp") else None  # For portability
+with tempfile.TemporaryDirectory(dir=tmp_dir_root) as tmpdirname:
+    small = os.path.join(tmpdirname, "small.gz")
+    with open(small, "w") as f:
+        for i in range(100):
+            f.write(text.format(i))
+
+    for ext in ".gz", ".bz2", ".xz":
+        filename = os.path.join(tmpdirname, "bench" + ext)
+        with open(filename, "w") as f:
+            for i in range(num_lines):
+                f.write(text.format(i))
+        codec = portage_utils.get_codec(filename)
+        for how in "subprocess", "in_process":
+            start = time.time()
+            count, size = read_all(codec, filename, how)
+            elapsed = time.time() - start
+            assert count == num_lines
+            print("{:4} {:10}: {:6.2f}s {:8.0f} lines/s {:7.1f} MB/s".format(
+                ext, how, elapsed, count / elapsed, size / elapsed / 1e6))
+
+    # Per-file overhead, which dominates when many small shards are opened
+    codec = portage_utils.get_codec(small)
+    for how in "subprocess", "in_process":
+        start = time.time()
+        for _ in range(200):
+            read_all(codec, small, how)
+        elapsed = time.time() - start
+        print("small .gz {:10}: {:6.2f} ms per file".format(how, elapsed / 200 * 1000))
+
+    # Compression threads for .gz output
+    lines = [text.format(i) for i in range(num_lines)]
+    size = sum(len(l.encode()) for l in lines)
+    filename = os.path.join(tmpdirname, "out.gz")
+    for threads in sorted({1, os.cpu_count() or 1, 4}):
+        start = time.time()
+        with open(filename, "w", threads=threads) as f:
+            f.writelines(lines)
+        elapsed = time.time() - start
+        print("write .gz {:2} threads: {:6.2f}s {:7.1f} MB/s".format(
+            threads, elapsed, size / elapsed / 1e6))
@@ -0,0 +1,5 @@
+#!/bin/bash
+
+make clean
+make all
+exit
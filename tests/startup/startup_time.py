@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# @file startup_time.py
+# @brief Check that a script doesn't import slow modules at start up, and
+# optionally that its imports fit in a time budget.
+#
+# Our pipelines call the Python scripts thousands of times on small shards, so
+# their start up time matters.  The time spent importing modules, as reported
+# by python3 -X importtime, is the part of it that depends on our code.  The
+# budget is relative to the import time of python3 -c pass, i.e., of the
+# modules every Python script imports, measured in the same run.
+#
+# Usage: python3 startup_time.py [-n RUNS] [-forbid MODULES] [-budget BUDGET] SCRIPT [ARGS...]
+#
+# Multilingual Text Processing / Traitement multilingue de textes
+# Digital Technologies Research Centre / Centre de recherche en technologies numériques
+# National Research Council Canada / Conseil national de recherches Canada
+# Copyright 2026, His Majesty the King in Right of Canada /
+# Copyright 2026, Sa Majeste le Roi du Chef du Canada
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from argparse import REMAINDER, ArgumentParser
+
+
+def import_times(args, env):
+    """Run python3 -X importtime with args, e.g., a script and its arguments.
+
+    return: the total import time in ms, and the set of modules imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        env=env,
+    )
+    total = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or line.endswith("imported package"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):
+            # Top-level imports: their cumulative times add up to the total
+            total += int(cumulative_us)
+        modules.add(name.strip())
+    return total / 1000, modules
+
+
+def fastest(args, env, runs):
+    """Return the import times of the fastest of runs runs of args, and the
+    modules imported.  A first run caches the byte code, like in any
+    installation, so it is not timed.
+    """
+    import_times(args, env)
+    times = [import_times(args, env) for _ in range(runs)]
+    return min(total for total, modules in times), times[0][1]
+
+
+def main():
+    parser = ArgumentParser(description="Check the start up import time of a script.")
+    parser.add_argument("-n", dest="runs", type=int, default=5,
+                        help="keep the fastest of this many runs, for stable timings [%(default)s]")
+    parser.add_argument("-forbid", dest="forbid", default="",
+                        help="comma-separated modules the script must not import at start up")
+    parser.add_argument("-budget", dest="budget", type=float, default=None,
+                        help="import time budget, as a multiple of that of python3 -c pass "
+                             "[none: only check -forbid]")
+    parser.add_argument("script", help="script to run, found on $PATH")
+    parser.add_argument("args", nargs=REMAINDER, help="arguments to the script, e.g., -h")
+    cmd_args = parser.parse_args()
+
+    script = os.path.realpath(shutil.which(cmd_args.script) or cmd_args.script)
+    name = os.path.basename(script)
+    root = os.path.dirname(os.path.dirname(script))
+    with tempfile.TemporaryDirectory(prefix="startup.") as tmp_dir:
+        # Run a copy of the scripts and their library, so that their byte code
+        # can be cached without writing next to them.
+        for subdir in "bin", "lib":
+            shutil.copytree(os.path.join(root, subdir), os.path.join(tmp_dir, subdir),
+                            ignore=shutil.ignore_patterns("__pycache__"))
+        env = dict(os.environ)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        env["PYTHONPATH"] = os.pathsep.join(
+            filter(None, [os.path.join(tmp_dir, "lib"), env.get("PYTHONPATH")]))
+        args = [os.path.join(tmp_dir, "bin", name)] + cmd_args.args
+        if cmd_args.budget is None:
+            # Timings are not needed, and the modules imported don't vary.
+            ms, modules = import_times(args, env)
+        else:
+            baseline, _ = fastest(["-c", "pass"], env, cmd_args.runs)
+            ms, modules = fastest(args, env, cmd_args.runs)
+
+    forbidden = sorted(set(filter(None, cmd_args.forbid.split(","))) & modules)
+    over_budget = cmd_args.budget is not None and ms / baseline > cmd_args.budget
+    if cmd_args.budget is not None:
+        print("{}: imports take {:.1f} ms, {:.1f} times python3 -c pass ({:.1f} ms), budget {:g}"
+              .format(name, ms, ms / baseline, baseline, cmd_args.budget))
+    if forbidden:
+        print("{}: imports {} at start up".format(name, ", ".join(forbidden)), file=sys.stderr)
+    if over_budget:
+        print("{}: start up is over budget".format(name), file=sys.stderr)
+    if forbidden or over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()